@@ -18,10 +18,21 @@ class sine_sig_gen():
             where amplitude is fractional with respect to the fundamental and phase is in radians.
             First element represents the second harmonic
         quantize - whether or not to quantize values.
+        quantizer - None for the ideal quantizer (round to nearest code), or a table_quantizer
+            modelling a real converter's transition levels. Only used when quantize is True.
+        rng - np.random.Generator used for jitter and noise. None (the default) uses the global np.random state.
+        block_size - samples synthesized per pass by generate(). Bounds its float64 scratch memory.
+        harmonic_method - "direct" calls np.sin once per harmonic. "recurrence" builds every harmonic from
+            the fundamental with the Chebyshev recurrence, so long harmonic lists cost a few multiply-adds each.
     
     Methods:
         generate - returns quantized ADC values as floating point array of length N,
         or unquantized floating point values if quantize attribute is set to False.
+        Pass dtype (e.g. np.int16) for compact output, or out= to fill a preallocated array.
+        generate_batch - same as generate, but returns M independent records as an (M, N) array,
+        with separate jitter and noise for every row.
+        stream - generator yielding fixed-size chunks of an endless, phase-continuous record.
+        harmonic_error - maximum difference between the "recurrence" and "direct" harmonic methods, in volts.
     """
     def __init__(self):
         self.N = 4096
@@ -37,21 +48,99 @@ class sine_sig_gen():
         self.harmonics = [[0.0, 1.0], [0.0, 2.0]] # Harmonic, each element is [fractional amplitude, phase]
         self.bits = 16
         self.quantize = True
+        self.harmonic_method = "direct"
+        self.rng = None
+        self.quantizer = None
+        self.block_size = 65536
 
-    def generate(self):
-    
-        smp_times = np.arange(0, self.N/self.fs, 1.0/self.fs)
-        """Sampling instants. We want N samples, taken at some sample rate fs in Hertz, which implies 1/fs
-        seconds between samples. The NumPy arange function returns evenly spaced values within a given
-        interval, which is exactly what we want."""
-
-        smp_jitter = np.random.normal(loc=0, scale=self.jitter, size=self.N)
-        """Jitter values. These are added to the sample times, with the effect that the sample times are
-        "wiggled" around a bit. If the signal is slewing, the digitized amplitude will be affected. """
-        
-        smp_times += smp_jitter
-        
-        signal = self.signal_ampl * np.sin(2.0*np.pi*self.freq*smp_times+self.phase)
+    def generate(self, out=None, dtype=None):
+        """out - optional caller-owned array of length N (e.g. an np.memmap) to write the result into.
+        dtype - output type. Integer types (np.int16, np.int32) hold quantized codes, clipped to the type's
+        range; float types (np.float32) hold codes or infinity-bit values. Defaults to out.dtype, or float64.
+        The record is synthesized block_size samples at a time, straight into the output, so the float64
+        scratch memory is a few blocks however long the record is."""
+
+        if dtype is None:
+            dtype = np.float64 if out is None else out.dtype
+        if out is None:
+            out = np.empty(self.N, dtype=dtype)
+
+        for start in range(0, self.N, self.block_size):
+            stop = min(start + self.block_size, self.N)
+
+            smp_times = np.arange(start, stop, dtype=np.float64)
+            smp_times /= self.fs
+            """Sampling instants. We want N samples, taken at some sample rate fs in Hertz, which implies 1/fs
+            seconds between samples. The NumPy arange function returns evenly spaced values, which we scale
+            in place to get the sample times. Each block gets its own slice of the same time base."""
+
+            smp_jitter = self._random().normal(loc=0, scale=self.jitter, size=stop - start)
+            """Jitter values. These are added to the sample times, with the effect that the sample times are
+            "wiggled" around a bit. If the signal is slewing, the digitized amplitude will be affected. """
+
+            smp_times += smp_jitter
+
+            signal = self._synthesize(smp_times)
+
+            noise = self._random().normal(loc=0, scale=self.t_noise, size=stop - start)
+            """ Random thermal noise. Set to zero if only modeling quantization noise. """
+            signal += noise
+
+            self._digitize(signal, out[start:stop], dtype)
+
+        return out
+
+    def generate_batch(self, M, out=None, dtype=None):
+        """Generate M records in one vectorized pass. Each row is an independent record, statistically
+        the same as one call to generate(), without paying the Python overhead M times."""
+
+        smp_times = np.arange(self.N) / self.fs
+        smp_times = smp_times + self._random().normal(loc=0, scale=self.jitter, size=(M, self.N))
+        """The time base is shared, the jitter is not. Broadcasting the (N,) time base against an (M, N)
+        jitter array gives every record its own set of wiggled sampling instants."""
+
+        signal = self._synthesize(smp_times)
+        signal += self._random().normal(loc=0, scale=self.t_noise, size=(M, self.N))
+
+        return self._digitize(signal, out, dtype)
+
+    def stream(self, chunk_size=None, n_chunks=None, dtype=None):
+        """Yield consecutive chunks of chunk_size samples (default N) forever, or n_chunks times.
+        The chunks join up into one long phase-continuous record, but only one chunk is held in memory.
+        dtype is as for generate()."""
+
+        if chunk_size is None:
+            chunk_size = self.N
+        cycles = 0.0
+        """Fundamental phase at the start of the current chunk, in cycles. It is carried from chunk to
+        chunk modulo one, instead of letting the absolute sample time grow without bound. After a few hours
+        of simulated time, freq * t would have eaten most of the 64-bit mantissa."""
+
+        chunk_times = np.arange(chunk_size) / self.fs
+        cycles_per_chunk = self.freq * chunk_size / self.fs
+
+        count = 0
+        while n_chunks is None or count < n_chunks:
+            smp_times = chunk_times + self._random().normal(loc=0, scale=self.jitter, size=chunk_size)
+            signal = self._synthesize(smp_times, 2.0*np.pi*cycles)
+            signal += self._random().normal(loc=0, scale=self.t_noise, size=chunk_size)
+            yield self._digitize(signal, None, dtype)
+
+            cycles = (cycles + cycles_per_chunk) % 1.0
+            count += 1
+
+    def _random(self):
+        return np.random if self.rng is None else self.rng
+
+    def _synthesize(self, smp_times, start_phase=0.0):
+        """Fundamental plus harmonics, evaluated at smp_times (any shape). start_phase is the fundamental
+        phase at smp_times == 0; harmonic k sees k times that, so harmonics stay locked across stream chunks."""
+
+        wt = smp_times * (2.0*np.pi*self.freq)
+        wt += start_phase
+        signal = np.add(wt, self.phase)
+        np.sin(signal, out=signal)
+        signal *= self.signal_ampl
         """Okay, generate the signal. We are using the strict mathematical definition of amplitude, which
         is half of the peak-to-peak excursion of the signal. The sine function swings from -1.0 to +1.0,
         so no scaling factor is necessary.
@@ -59,25 +148,97 @@ class sine_sig_gen():
         taken over the measurement interval. In the voltage domain, the precision is 64-bit floating
         point, MUCH finer than any real world ADC."""
 
+        if self.harmonic_method == "recurrence":
+            signal += self._harmonics_recurrence(wt)
+            return signal
+
+        hval = np.empty_like(signal)
         hindex = 0 
         for harmonic in self.harmonics:
             """Generate harmonics. Cycle through list of harmonic amplitudes and phases, and add
-            them to the main signal."""
+            them to the main signal. hval is a scratch array reused for every harmonic."""
 
             hamp = self.signal_ampl * harmonic[0]
 
             hph = harmonic[1]
 
-            hval = hamp * np.sin(2.0*np.pi*self.freq*(hindex + 2.0)*smp_times+self.phase+hph)
-            #print("ampl, ph, a few values: ", hamp, hph, hval[:8])
-            signal += hval # Add harmonic to signal
+            if hamp != 0.0:
+                np.multiply(wt, hindex + 2.0, out=hval)
+                hval += self.phase + hph
+                np.sin(hval, out=hval)
+                hval *= hamp
+                #print("ampl, ph, a few values: ", hamp, hph, hval[:8])
+                signal += hval # Add harmonic to signal
             hindex += 1
         
-        noise = np.random.normal(loc=0, scale=self.t_noise, size=self.N)
-        """ Random thermal noise. Set to zero if only modeling quantization noise. """
-        signal += noise
+        return signal
+
+    def _harmonics_recurrence(self, wt):
+        """Sum of all harmonics, using only the sine and cosine of the fundamental.
+        sin(k*wt) and cos(k*wt) follow the Chebyshev recurrence
+            x[k+1] = 2*cos(wt)*x[k] - x[k-1]
+        so each extra harmonic is a multiply and a subtract per sample instead of a call to np.sin.
+        The rounding error grows roughly linearly with harmonic order; see harmonic_error()."""
+
+        two_cos = 2.0 * np.cos(wt)
+        s_prev = np.sin(wt)
+        c_prev = 0.5 * two_cos
+        s_cur = two_cos * s_prev        # sin(2*wt)
+        c_cur = two_cos * c_prev - 1.0  # cos(2*wt)
+        tmp = np.empty_like(s_cur)
+        hsum = np.zeros_like(s_cur)
 
-        adc_inf_bits = ((signal / self.vref) * 2**self.bits)
+        for harmonic in self.harmonics:
+            hamp = self.signal_ampl * harmonic[0]
+            hph = self.phase + harmonic[1]
+
+            # hamp * sin(k*wt + hph), expanded so the phase offset is just two scalar weights
+            if hamp != 0.0:
+                np.multiply(s_cur, hamp * np.cos(hph), out=tmp)
+                hsum += tmp
+                np.multiply(c_cur, hamp * np.sin(hph), out=tmp)
+                hsum += tmp
+
+            # Step to the next harmonic, reusing the k-1 arrays as storage for k+1
+            np.multiply(two_cos, s_cur, out=tmp)
+            np.subtract(tmp, s_prev, out=s_prev)
+            s_prev, s_cur = s_cur, s_prev
+            np.multiply(two_cos, c_cur, out=tmp)
+            np.subtract(tmp, c_prev, out=c_prev)
+            c_prev, c_cur = c_cur, c_prev
+
+        return hsum
+
+    def harmonic_error(self):
+        """Maximum absolute difference, in volts, between the recurrence and direct harmonic engines over
+        one N-sample record with the current settings. Divide by vref / 2**bits to express it in LSBs."""
+
+        smp_times = np.arange(self.N) / self.fs
+        method = self.harmonic_method
+        try:
+            self.harmonic_method = "direct"
+            direct = self._synthesize(smp_times)
+            self.harmonic_method = "recurrence"
+            recurrence = self._synthesize(smp_times)
+        finally:
+            self.harmonic_method = method
+
+        return np.max(np.abs(recurrence - direct))
+
+    def _digitize(self, signal, out=None, dtype=None):
+        """Map the analog signal to ADC codes (or infinity-bit values if quantize is False).
+        signal is a float64 work array and is overwritten. The result is written into out if given,
+        otherwise into a new array of the requested dtype."""
+
+        if dtype is None:
+            dtype = np.float64 if out is None else out.dtype
+        dtype = np.dtype(dtype)
+        if dtype.kind in "iu" and not self.quantize:
+            raise ValueError("Integer output dtype requires quantize = True")
+
+        adc_inf_bits = signal
+        adc_inf_bits /= self.vref
+        adc_inf_bits *= 2**self.bits
         """THIS could be considered the "Fundamental ADC equation". An ADC performs the mathematical operation of
         division - the output code is proportional to the input voltage divided by the reference. Maybe with some
         offset, maybe with some scaling factor, but fundamentally, it's plain old division. The signal is mapped
@@ -86,9 +247,91 @@ class sine_sig_gen():
         Note the name of this variable, which implies an "infinity bit ADC". It's not really infinity bits, but
         in this case, a 64-bit float is close enough to infinity that we can assume it's infinity. """        
 
-        adc_output = np.around(adc_inf_bits, decimals=0)
-
-        if self.quantize:
-            return adc_output
+        if self.quantize and self.quantizer is not None:
+            adc_output = self.quantizer(adc_inf_bits)
+        elif self.quantize:
+            adc_output = np.around(adc_inf_bits, decimals=0, out=adc_inf_bits)
         else:
-            return adc_inf_bits
\ No newline at end of file
+            adc_output = adc_inf_bits
+
+        if dtype.kind in "iu":
+            """A full-scale positive input lands on code 2**(bits-1), one past the largest int16 for a
+            16-bit converter. Clip rather than let the cast wrap around."""
+            limits = np.iinfo(dtype)
+            np.clip(adc_output, limits.min, limits.max, out=adc_output)
+
+        if out is None:
+            if dtype == adc_output.dtype:
+                return adc_output
+            return adc_output.astype(dtype)
+
+        np.copyto(out, adc_output, casting="unsafe")
+        return out
+
+class table_quantizer():
+    """Nonideal quantizer, defined by a table of code transition levels. Plug it into
+    sine_sig_gen.quantizer to model INL, DNL, missing codes, offset and gain error.
+
+    Attributes:
+        transitions - ascending array of 2**bits - 1 transition levels, in the same units as adc_inf_bits
+            (ideal LSBs). transitions[k] is the input at which the output steps from code first_code + k
+            to first_code + k + 1.
+        first_code - output code below the first transition, -2**(bits-1) for a bipolar converter.
+            Inputs beyond either end of the table saturate at the first or last code.
+
+    Methods:
+        from_errors - build the table from an ideal converter plus error terms.
+        __call__ - map an array of adc_inf_bits values to integer codes.
+    """
+    def __init__(self, transitions, first_code):
+        self.transitions = np.asarray(transitions, dtype=np.float64)
+        if np.any(np.diff(self.transitions) < 0):
+            raise ValueError("Transition levels must be in ascending order")
+        self.first_code = first_code
+
+        t = self.transitions
+        self._b0 = np.floor(t[0]) - 1.0
+        buckets = np.arange(self._b0, np.floor(t[-1]) + 2.0)
+        self._lo = np.searchsorted(t, buckets, side="right")
+        self._span = int(np.max(np.searchsorted(t, buckets + 1.0, side="left") - self._lo))
+        self._padded = np.concatenate((t, np.full(self._span, np.inf)))
+        """Lookup tables, built once and reused for every record. The input range is cut into one-LSB
+        buckets. _lo holds how many transitions lie at or below the bottom of each bucket, and _span is the
+        most transitions any single bucket contains (1 for a well-behaved converter, a few with large DNL).
+        Quantizing a sample is then one table lookup plus _span comparisons, instead of a full binary
+        search over up to a million levels. The result is identical to np.searchsorted(transitions, x, "right")."""
+
+    @classmethod
+    def from_errors(cls, bits, inl=None, dnl=None, offset=0.0, gain_error=0.0, missing_codes=()):
+        """Ideal bipolar converter plus errors, all in LSBs:
+            dnl - per-code width error, length 2**bits (the two end codes are open-ended and ignored).
+            inl - per-transition error added on top, length 2**bits - 1.
+            offset - shifts every transition.
+            gain_error - fractional gain error; scales every transition about zero.
+            missing_codes - codes that never appear at the output (width zero).
+        """
+        first_code = -2**(bits-1)
+        widths = np.ones(2**bits)
+        if dnl is not None:
+            widths += dnl
+        transitions = first_code + 0.5 + np.concatenate(([0.0], np.cumsum(widths[1:-1])))
+        if inl is not None:
+            transitions += inl
+        transitions *= 1.0 + gain_error
+        transitions += offset
+        for code in missing_codes:
+            # Collapse the code's upper edge onto its lower edge, after INL has had its say
+            transitions[code - first_code] = transitions[code - first_code - 1]
+
+        return cls(np.maximum.accumulate(transitions), first_code)
+
+    def __call__(self, adc_inf_bits):
+        bucket = np.subtract(adc_inf_bits, self._b0)
+        np.clip(bucket, 0, len(self._lo) - 1, out=bucket)
+        base = self._lo[bucket.astype(np.intp)] # Truncation is floor here, the values are non-negative
+        codes = base.copy()
+        for j in range(self._span):
+            codes += self._padded[base + j] <= adc_inf_bits
+        codes += self.first_code
+
+        return codes
@@ -0,0 +1,80 @@
+"""Monte Carlo parameter sweeps over sine_sig_gen, spread across a process pool.
+
+Every point of the parameter grid gets its own np.random.Generator, spawned from a single SeedSequence.
+The stream belongs to the grid point, not to the worker that happens to run it, so a sweep gives
+bit-identical results with 1 worker or 32.
+"""
+
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np # Import NumPy library
+
+from signal_gen import sine_sig_gen
+from adc_analysis import analyze
+
+
+def grid_points(grid):
+    """Expand {"bits": [12, 16], "jitter": [0, 1e-9]} into a list of dicts, one per combination.
+    The last parameter varies fastest, like nested for loops in the order given."""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_point(params, seed, records, window):
+    """Simulate and score one grid point. Runs in a worker process, so everything it needs is passed in."""
+    gen = sine_sig_gen()
+    for name, value in params.items():
+        setattr(gen, name, value)
+    gen.rng = np.random.default_rng(seed)
+
+    metrics = analyze(gen.generate_batch(records), window=window)
+    result = dict(params)
+    for name in ("snr", "sinad", "thd", "sfdr", "enob"):
+        result[name] = float(np.mean(metrics[name]))
+        result[name + "_std"] = float(np.std(metrics[name]))
+    return result
+
+
+def sweep(grid, records=16, seed=0, workers=None, window="rect", progress=True):
+    """Run every combination in grid and return a list of result dicts, in grid order.
+
+    grid - dict of sine_sig_gen attribute name -> list of values to try.
+    records - records simulated per grid point; metrics are averaged over them.
+    seed - master seed. Same seed and grid, same results, however many workers.
+    workers - process count, None for one per CPU.
+    window - passed to adc_analysis.analyze(). The default sine_sig_gen settings are coherent, so "rect".
+    progress - print progress and throughput while running.
+    """
+    points = grid_points(grid)
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    results = [None] * len(points)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run_point, params, child, records, window): i
+                   for i, (params, child) in enumerate(zip(points, seeds))}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress:
+                elapsed = time.perf_counter() - start
+                print("\r%d/%d points, %.1f points/s, %.0f records/s"
+                      % (done, len(points), done / elapsed, done * records / elapsed), end="")
+    if progress:
+        print()
+
+    return results
+
+
+if __name__ == '__main__':
+    # ENOB vs. jitter for a few converter resolutions
+    gen = sine_sig_gen()
+    gen.N = 8192
+    grid = {"N": [gen.N],
+            "freq": [gen.fs * 1001 / gen.N], # Odd bin, coherent, near fs/8
+            "signal_ampl": [2.45],
+            "bits": [12, 14, 16],
+            "jitter": [0.0, 1e-9, 3e-9, 1e-8, 3e-8, 1e-7]}
+    for r in sweep(grid, records=32):
+        print("bits %2d  jitter %.1e s  ENOB %.2f +/- %.2f" % (r["bits"], r["jitter"], r["enob"], r["enob_std"]))
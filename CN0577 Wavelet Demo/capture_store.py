@@ -0,0 +1,167 @@
+# Copyright (C) 2022 Analog Devices, Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     - Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     - Neither the name of Analog Devices, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#     - The use of this software may or may not infringe the patent rights
+#       of one or more patent holders.  This license does not release you
+#       from the requirement that you obtain separate licenses from these
+#       patent holders to use this software.
+#     - Use of the software either in source or binary form, must be run
+#       on or directly connected to an Analog Devices Inc. component.
+#
+# THIS SOFTWARE IS PROVIDED BY ANALOG DEVICES "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED.
+#
+# IN NO EVENT SHALL ANALOG DEVICES BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, INTELLECTUAL PROPERTY
+# RIGHTS, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# AUTHOR: TRISHA CABILDO
+
+
+# Chunked binary storage for captures and generated waveforms.
+#
+# File layout, all integers little-endian uint64:
+#     magic (8 bytes) | data offset | n_samples | index offset | JSON header ... | samples ... | chunk index
+# The JSON header holds the sample dtype, channel count and free-form metadata (sample rate, vref, vcm,
+# wavelet parameters, ...). It is written once, padded so the samples start on a page boundary, and the
+# samples are then appended chunk after chunk and never move, so readers can memory-map them in place.
+# n_samples is rewritten in place after every chunk lands, so a recording that is killed part way
+# through still reads back up to its last complete chunk. The length of every chunk is kept in a
+# trailing index written by close(); the index offset stays 0 until then.
+
+import json
+import struct
+from itertools import islice
+
+import numpy as np
+
+magic = b"RUSCAP02"
+_fixed = struct.Struct("<QQQ")                                                                  #data offset, n_samples, index offset
+_page = 4096
+
+class capture_writer():
+    """
+    Append-only capture file writer. Use as a context manager, or call close() when done.
+    An instance can also be passed straight to ring_capture as a consumer.
+
+    Attributes:
+        path - output file
+        dtype - sample type, e.g. np.int32 for LTC2387 codes or np.float64 for M2K volts
+        channels - samples per frame; blocks are (n,) for one channel or (n, channels)
+        metadata - free-form dict saved in the header
+
+    Methods:
+        append - write one block of samples as a new chunk. Constant cost however many chunks came before.
+        close - write the chunk index
+    """
+    def __init__(self, path, dtype, channels=1, **metadata):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.metadata = metadata
+        self.chunks = []
+        self.n_samples = 0
+        text = json.dumps({"dtype": self.dtype.str, "channels": channels, "metadata": metadata}).encode()
+        self.data_offset = -(-(len(magic) + _fixed.size + len(text)) // _page) * _page
+        self.f = open(path, "wb")
+        self.f.write(magic + _fixed.pack(self.data_offset, 0, 0) + text)
+        self.f.write(b" " * (self.data_offset - self.f.tell()))
+
+    def append(self, block):
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if block.size % self.channels:
+            raise ValueError("Block size is not a whole number of %d-channel frames" % self.channels)
+        frames = block.size // self.channels
+        self.f.write(memoryview(block).cast("B"))
+        self.chunks.append(frames)
+        self.n_samples += frames
+        self._write_fixed(0)
+
+    def _write_fixed(self, index_offset):
+        #Seeking flushes the samples written so far, so the count never gets ahead of the data
+        end = self.f.tell()
+        self.f.seek(len(magic))
+        self.f.write(_fixed.pack(self.data_offset, self.n_samples, index_offset))
+        self.f.seek(end)
+        self.f.flush()
+
+    def __call__(self, buffer, seq=None):
+        self.append(buffer)
+
+    def close(self):
+        if self.f.closed:
+            return
+        index_offset = self.f.tell()
+        self.f.write(np.asarray(self.chunks, dtype="<u8").tobytes())
+        self._write_fixed(index_offset)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_capture(path):
+    # Returns (header, data). data is a read-only np.memmap of shape (n_samples, channels) (or
+    # (n_samples,) for one channel) over the file itself - nothing is copied until it is used.
+    # header["complete"] is False for a file that was never closed; its samples are still readable,
+    # but the chunk boundaries are lost and header["chunks"] is one chunk covering everything.
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("%s is not a capture file" % path)
+        data_offset, n_samples, index_offset = _fixed.unpack(f.read(_fixed.size))
+        header = json.loads(f.read(data_offset - f.tell()))
+        if index_offset:
+            f.seek(index_offset)
+            chunks = np.frombuffer(f.read(), dtype="<u8").tolist()
+        else:
+            chunks = [n_samples] if n_samples else []
+    header.update(n_samples=n_samples, chunks=chunks, complete=bool(index_offset))
+
+    shape = (n_samples, header["channels"]) if header["channels"] > 1 else (n_samples,)
+    if n_samples == 0:
+        return header, np.empty(shape, dtype=header["dtype"])
+    data = np.memmap(path, dtype=header["dtype"], mode="r", offset=data_offset, shape=shape)
+    return header, data
+
+def capture_chunks(header, data):
+    # Yields each chunk as written, as views into data
+    start = 0
+    for n in header["chunks"]:
+        yield data[start:start + n]
+        start += n
+
+def csv_to_capture(csv_path, cap_path, dtype=np.float64, rows_per_chunk=100000, **metadata):
+    # Converts a legacy CSV dump (one column per channel, no header, e.g. the old m2k_ricker_wav.csv)
+    # without loading the whole file; rows_per_chunk rows at a time become one chunk.
+    writer = None
+    with open(csv_path) as f:
+        while True:
+            lines = list(islice(f, rows_per_chunk))
+            if not lines:
+                break
+            block = np.loadtxt(lines, delimiter=",", dtype=dtype, ndmin=2)
+            if writer is None:
+                writer = capture_writer(cap_path, dtype, block.shape[1], **metadata)
+            writer.append(block)
+    if writer is None:
+        writer = capture_writer(cap_path, dtype, 1, **metadata)
+    writer.close()
+    return cap_path
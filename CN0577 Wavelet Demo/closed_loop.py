@@ -0,0 +1,171 @@
+# Copyright (C) 2022 Analog Devices, Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     - Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     - Neither the name of Analog Devices, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#     - The use of this software may or may not infringe the patent rights
+#       of one or more patent holders.  This license does not release you
+#       from the requirement that you obtain separate licenses from these
+#       patent holders to use this software.
+#     - Use of the software either in source or binary form, must be run
+#       on or directly connected to an Analog Devices Inc. component.
+#
+# THIS SOFTWARE IS PROVIDED BY ANALOG DEVICES "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED.
+#
+# IN NO EVENT SHALL ANALOG DEVICES BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, INTELLECTUAL PROPERTY
+# RIGHTS, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# AUTHOR: TRISHA CABILDO
+
+
+# Closed-loop test: generate random Ricker wavelets on the M2K, capture them with the LTC2387, and
+# measure how faithfully each one came back.
+#
+# Three stages run at once: a worker thread synthesizes the next wavelets, the main thread pushes one
+# and captures it, and a thread pool aligns and scores the previous captures. Captured data is aligned
+# to the stimulus with an FFT circular cross-correlation (the M2K output is cyclic), then gain, offset,
+# delay and residual error come from a least-squares fit. Each capture spans at least one full stimulus
+# period, so the wavelet is always in it and the correlation sees the whole waveform.
+
+import sys
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+import numpy as np
+from scipy import fft
+from scipy.signal import resample_poly
+
+from wavelet_gen import random_ricker, diff_synth, wav_init, wav_close, put_unless_stopped, sr
+from cn0577_wavelet_demo import setup_adc, sampling_freq, vref
+
+adc_lsb = vref / 2**17                                                                          #Volts per code, LTC2387-18 (+/-vref differential)
+loop_prefetch = 4                                                                               #Wavelets synthesized ahead of the output
+discard_buffers = 1                                                                             #rx() buffers thrown away after each push while the output switches
+
+def stimulus_at_adc_rate(wav):
+    # Differential stimulus (P - N = 2 * wav) resampled from the M2K rate to the ADC rate
+    ratio = Fraction(sampling_freq, sr)
+    return resample_poly(2.0 * wav, ratio.numerator, ratio.denominator)
+
+def period_samples(n_m2k):
+    # ADC samples needed to cover one period of an n_m2k-sample cyclic M2K buffer
+    return -(-n_m2k * sampling_freq // sr)
+
+def resize_rx(my_adc, n):
+    # pyadi-iio keeps the IIO buffer created by the first rx(); destroy it so the new size takes effect
+    my_adc.rx_destroy_buffer()
+    my_adc.rx_buffer_size = n
+
+def align(captured, stimulus):
+    # Circular cross-correlation by FFT, at the stimulus period. Returns the shift k (in samples) that
+    # lines captured[n] up with stimulus[(n + k) % len(stimulus)], and the aligned stimulus segment.
+    # The capture must cover at least one period; it is aligned on its first period and the
+    # segment returned covers all of it.
+    period = len(stimulus)
+    if len(captured) < period:
+        raise ValueError("Capture of %d samples is shorter than the %d-sample stimulus period"
+                         % (len(captured), period))
+    head = captured[:period]
+    c = fft.irfft(np.conj(fft.rfft(head - np.mean(head), period)) * fft.rfft(stimulus), period)
+    k = int(np.argmax(c))
+    return k, np.take(stimulus, np.arange(k, k + len(captured)), mode="wrap")
+
+def compare(wav, captured):
+    # Score one capture (ADC codes) against the wavelet that was playing
+    stimulus = stimulus_at_adc_rate(wav)
+    volts = np.asarray(captured, dtype=np.float64) * adc_lsb
+    k, ref = align(volts, stimulus)
+
+    design = np.column_stack((ref, np.ones_like(ref)))
+    (gain, offset), *_ = np.linalg.lstsq(design, volts, rcond=None)
+    residual = volts - (gain * ref + offset)
+    return {"gain": gain,
+            "offset": offset,
+            "delay": k / sampling_freq,
+            "residual_rms": float(np.sqrt(np.mean(residual**2))),
+            "residual_pk": float(np.max(np.abs(residual)))}
+
+def wavelet_producer(wavelets, count, stop):
+    # Queues (wav, w1, w2) tuples. If synthesis fails, the exception is queued instead, for the
+    # main thread to re-raise, so it never waits on a producer that has died.
+    try:
+        for _ in range(count):
+            wav = random_ricker()
+            w1, w2 = diff_synth(wav)
+            item = (wav, w1.copy(), w2.copy())                                                 #diff_synth reuses its buffers
+            if not put_unless_stopped(wavelets, item, stop):
+                return
+    except Exception as e:
+        put_unless_stopped(wavelets, e, stop)
+
+def closed_loop(ctx, my_adc, count, workers=2):
+    aout = ctx.getAnalogOut()
+    aout.setSampleRate(0, sr)
+    aout.setSampleRate(1, sr)
+    aout.enableChannel(0, True)
+    aout.enableChannel(1, True)
+    aout.setCyclic(True)
+
+    wavelets = queue.Queue(maxsize=loop_prefetch)
+    stop = threading.Event()
+    producer = threading.Thread(target=wavelet_producer, args=(wavelets, count, stop), daemon=True)
+    producer.start()
+
+    futures = []
+    buffer_size = my_adc.rx_buffer_size
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for i in range(count):
+                item = wavelets.get()
+                if isinstance(item, Exception):
+                    raise item
+                wav, w1, w2 = item
+                if my_adc.rx_buffer_size < period_samples(len(w1)):
+                    resize_rx(my_adc, period_samples(len(w1)))
+                aout.push([w1, w2])
+                for _ in range(discard_buffers):
+                    my_adc.rx()
+                futures.append(pool.submit(compare, wav, my_adc.rx()))
+            results = [f.result() for f in futures]
+    finally:
+        stop.set()
+        producer.join()
+        if my_adc.rx_buffer_size != buffer_size:
+            resize_rx(my_adc, buffer_size)
+    elapsed = time.perf_counter() - start
+
+    print("%d wavelets in %.1f s, %.0f wavelets/min" % (count, elapsed, count / elapsed * 60))
+    return results
+
+if __name__ == '__main__':
+    hardcoded_ip = 'ip:localhost'
+    my_ip = sys.argv[1] if len(sys.argv) >= 2 else hardcoded_ip
+    count = int(sys.argv[2]) if len(sys.argv) >= 3 else 100
+
+    ctx = wav_init()
+    my_adc = setup_adc(my_ip)
+    results = closed_loop(ctx, my_adc, count)
+    for r in results[:10]:
+        print("gain %.4f  offset %+.2f mV  delay %.2f us  residual %.2f mV rms"
+              % (r["gain"], r["offset"]*1e3, r["delay"]*1e6, r["residual_rms"]*1e3))
+    wav_close(ctx)
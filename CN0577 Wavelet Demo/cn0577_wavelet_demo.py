@@ -37,14 +37,16 @@ import os
 import sys
 import time
 import math
+import queue
+import threading
 import numpy as np
 from adi import ltc2387
-from wavelet_gen import random_ricker, wavdiff_out, wav_init, wav_close, wav_gen_main
-from scipy.signal import cwt
+from wavelet_gen import random_ricker, wavdiff_out, wav_init, wav_close
 
 n_samples = 256000                                                                              #Number of samples taken
 sampling_freq = 10000000                                                                        #Master clock @120 MHz (f_sampling = master_clock / 12)
 vref = 4.096                                                                                    #From REFBUF pin of LTC2387
+ring_depth = 8                                                                                  #Buffers in the continuous capture ring
 
 #This function sets up the ADC
 def setup_adc(my_ip):
@@ -60,12 +62,149 @@ def adc_capture(my_adc):
 
     return adc_data
 
-def main():
-    my_adc = setup_adc()
-    m2k_ctx = wav_gen_main()
-    adc_data = adc_capture()
+class ring_capture():
+    """
+    Continuous capture. A reader thread calls rx() back to back and copies each buffer into a free slot of
+    a preallocated ring; a consumer thread hands full slots to each consumer (analysis, disk writer, ...)
+    in order and then returns them to the ring. If every slot is still busy when rx() returns, that buffer
+    is dropped and counted, rather than stalling the reader.
 
-    return m2k_ctx
+    Attributes:
+        adc - ltc2387 instance, already set up with setup_adc()
+        consumers - callables, each called as consumer(buffer, seq) with a read-only view of the slot.
+            The view is only valid until the consumer returns; copy it to keep it.
+        depth - number of ring slots
+        captured, dropped - buffer counters
+
+    Methods:
+        start, stop - start and stop capturing. stop() waits for consumers to drain the ring. If rx() or a
+            consumer raised, capturing stops early and stop() re-raises that exception. A stopped capture
+            can be started again, with fresh counters.
+        stats - counters plus sustained capture rate in MS/s
+    """
+    def __init__(self, my_adc, consumers=(), depth=ring_depth):
+        self.adc = my_adc
+        self.consumers = list(consumers)
+        self.depth = depth
+        self.ring = None                                                                        #Allocated on the first rx(), once the dtype is known
+        self.captured = 0
+        self.dropped = 0
+        self.samples = 0
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_time = None
+        self._stop_time = None
+        self.error = None
+
+    def start(self):
+        #A stopped capture can be started again; counters and error start over from zero
+        if any(t.is_alive() for t in self._threads):
+            raise RuntimeError("Capture is already running")
+        self._free = queue.Queue()
+        self._full = queue.Queue()
+        self.ring = None                                                                        #The ADC buffer size may have changed since
+        for slot in range(self.depth):
+            self._free.put(slot)
+        self.captured = 0
+        self.dropped = 0
+        self.samples = 0
+        self.error = None
+        self._stop_time = None
+        self._stop.clear()
+        self._start_time = time.perf_counter()
+        self._threads = [threading.Thread(target=self._reader, daemon=True),
+                         threading.Thread(target=self._consumer, daemon=True)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        self._threads[0].join()
+        self._stop_time = time.perf_counter()
+        self._full.put(None)                                                                    #Consumer exits after draining what is queued
+        self._threads[1].join()
+        if self.error is not None:
+            raise self.error
+
+    def _fail(self, e):
+        #Keep the first error, and stop capturing buffers nobody will consume
+        if self.error is None:
+            self.error = e
+        self._stop.set()
+
+    def _reader(self):
+        try:
+            self._read_loop()
+        except Exception as e:
+            self._fail(e)
+
+    def _read_loop(self):
+        seq = 0
+        while not self._stop.is_set():
+            data = self.adc.rx()
+            if self.ring is None:
+                self.ring = np.empty((self.depth, len(data)), dtype=np.asarray(data).dtype)
+            try:
+                slot = self._free.get_nowait()
+            except queue.Empty:
+                self.dropped += 1
+            else:
+                np.copyto(self.ring[slot], data)
+                self._full.put((slot, seq))
+                self.captured += 1
+                self.samples += len(data)
+            seq += 1
+
+    def _consumer(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            slot, seq = item
+            view = self.ring[slot].view()
+            view.flags.writeable = False
+            if self.error is None:
+                try:
+                    for consumer in self.consumers:
+                        consumer(view, seq)
+                except Exception as e:
+                    self._fail(e)
+            self._free.put(slot)                                                                #Returned even after an error, so the reader never stalls
+
+    def stats(self):
+        end = self._stop_time if self._stop_time is not None else time.perf_counter()
+        elapsed = end - self._start_time
+        return {"captured": self.captured,
+                "dropped": self.dropped,
+                "samples": self.samples,
+                "elapsed": elapsed,
+                "msps": self.samples / elapsed / 1e6 if elapsed > 0 else 0.0,
+                "error": self.error}
+
+def capture_burst(my_adc, seconds, consumers=(), depth=ring_depth):
+    #Capture continuously for the given time and report what was achieved
+    capture = ring_capture(my_adc, consumers, depth)
+    capture.start()
+    time.sleep(seconds)
+    capture.stop()
+    stats = capture.stats()
+    print("Captured %d buffers (%d dropped), %.2f MS/s sustained of %.2f MS/s"
+          % (stats["captured"], stats["dropped"], stats["msps"], sampling_freq/1e6))
+    return stats
+
+def main(my_ip):
+    #Play a wavelet on the M2K and capture it with the CN0577. The M2K context is closed here, whatever happens.
+    my_adc = setup_adc(my_ip)
+    m2k_ctx = wav_init()
+    try:
+        wavdiff_out(m2k_ctx)
+        adc_data = adc_capture(my_adc)
+    finally:
+        wav_close(m2k_ctx)
+
+    return adc_data
 
 if __name__ == '__main__':
     print("ADI packages import done")
@@ -73,5 +212,4 @@ if __name__ == '__main__':
     my_ip = sys.argv[2] if len(sys.argv) >= 3 else hardcoded_ip
     print("\nConnecting with CN0577 context at %s" % (my_ip))
 
-    m2k_ctx = main()
-    wav_close(m2k_ctx)
\ No newline at end of file
+    adc_data = main(my_ip)
\ No newline at end of file
@@ -0,0 +1,123 @@
+# Copyright (C) 2022 Analog Devices, Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     - Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     - Neither the name of Analog Devices, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#     - The use of this software may or may not infringe the patent rights
+#       of one or more patent holders.  This license does not release you
+#       from the requirement that you obtain separate licenses from these
+#       patent holders to use this software.
+#     - Use of the software either in source or binary form, must be run
+#       on or directly connected to an Analog Devices Inc. component.
+#
+# THIS SOFTWARE IS PROVIDED BY ANALOG DEVICES "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED.
+#
+# IN NO EVENT SHALL ANALOG DEVICES BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, INTELLECTUAL PROPERTY
+# RIGHTS, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# AUTHOR: TRISHA CABILDO
+
+
+# Code density (histogram) linearity test for the LTC2387.
+#
+# The histogram test needs a lot of samples (hundreds of millions for an 18-bit converter) before
+# every code has enough hits. Nothing here ever holds the capture in memory. Samples are folded into a
+# fixed-size integer histogram one chunk at a time, from live rx() buffers or memory-mapped files,
+# and DNL/INL is worked out from the histogram at the end.
+
+import numpy as np
+
+adc_bits = 18                                                                                   #LTC2387-18
+chunk_samples = 1 << 22                                                                         #Samples per chunk when reading files
+
+class code_density():
+    """
+    Attributes:
+        bits - ADC resolution; the histogram has 2**bits bins
+        signed - True for two's complement output codes (LTC2387), False for offset binary
+        counts - running histogram, counts[i] is the number of hits on code i - offset
+        n_samples - total samples folded in so far
+
+    Methods:
+        update - add one chunk of output codes (any integer array). An instance can also be passed
+            straight to ring_capture as a consumer.
+        update_file - stream a raw binary capture file through update() via a memory map
+        result - DNL and INL per code, for a ramp or sinewave stimulus
+    """
+    def __init__(self, bits=adc_bits, signed=True):
+        self.bits = bits
+        self.signed = signed
+        self.offset = 2**(bits-1) if signed else 0
+        self.counts = np.zeros(2**bits, dtype=np.int64)
+        self.n_samples = 0
+
+    def update(self, chunk):
+        codes = np.asarray(chunk).reshape(-1).astype(np.int64)                                  #Private copy; float captures hold whole codes anyway
+        codes += self.offset
+        np.clip(codes, 0, len(self.counts) - 1, out=codes)
+        self.counts += np.bincount(codes, minlength=len(self.counts))
+        self.n_samples += codes.size
+
+    def __call__(self, buffer, seq=None):
+        self.update(buffer)
+
+    def update_file(self, path, dtype=np.int32, offset=0, chunk=chunk_samples):
+        """Histogram a raw capture file of dtype samples starting offset bytes in, without loading it."""
+        data = np.memmap(path, dtype=dtype, mode="r", offset=offset)
+        for start in range(0, len(data), chunk):
+            self.update(data[start:start + chunk])
+        del data
+
+    def result(self, stimulus="sine"):
+        """DNL and INL in LSBs, for every code between the lowest and highest code hit.
+        The two end codes soak up the overdrive and are left out.
+
+        stimulus - "ramp" for a slow linear ramp (ideal histogram is flat), or "sine" for a sinewave
+            that slightly overdrives the input (ideal histogram follows the arcsine density; IEEE 1241).
+
+        Returns a dict with "codes", "dnl", "inl" (arrays), "missing_codes" and "n_samples".
+        """
+        hit = np.nonzero(self.counts)[0]
+        if len(hit) < 3:
+            raise ValueError("Not enough codes hit for a linearity test")
+        lo, hi = hit[0], hit[-1]
+        counts = self.counts[lo:hi+1].astype(np.float64)
+
+        if stimulus == "ramp":
+            widths = counts[1:-1]
+        elif stimulus == "sine":
+            cumulative = np.cumsum(counts)[:-1] / counts.sum()
+            transitions = -np.cos(np.pi * cumulative)
+            widths = np.diff(transitions)
+            """Transition levels from the cumulative histogram. A sinewave spends a fraction
+            arccos(-v)/pi of its time below v (in units of its amplitude), so inverting that gives the
+            input level at each code edge. Amplitude and offset drop out when the widths are normalised."""
+        else:
+            raise ValueError("stimulus must be 'ramp' or 'sine'")
+
+        dnl = widths / np.mean(widths) - 1.0
+        inl = np.cumsum(dnl)
+        inl -= np.linspace(inl[0], inl[-1], len(inl))                                          #End-point fit
+
+        codes = np.arange(lo + 1, hi) - self.offset
+        return {"codes": codes,
+                "dnl": dnl,
+                "inl": inl,
+                "missing_codes": codes[counts[1:-1] == 0],
+                "n_samples": self.n_samples}
@@ -0,0 +1,110 @@
+# Copyright (C) 2022 Analog Devices, Inc.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#     - Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     - Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in
+#       the documentation and/or other materials provided with the
+#       distribution.
+#     - Neither the name of Analog Devices, Inc. nor the names of its
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#     - The use of this software may or may not infringe the patent rights
+#       of one or more patent holders.  This license does not release you
+#       from the requirement that you obtain separate licenses from these
+#       patent holders to use this software.
+#     - Use of the software either in source or binary form, must be run
+#       on or directly connected to an Analog Devices Inc. component.
+#
+# THIS SOFTWARE IS PROVIDED BY ANALOG DEVICES "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, NON-INFRINGEMENT, MERCHANTABILITY AND FITNESS FOR A
+# PARTICULAR PURPOSE ARE DISCLAIMED.
+#
+# IN NO EVENT SHALL ANALOG DEVICES BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, INTELLECTUAL PROPERTY
+# RIGHTS, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF
+# THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# AUTHOR: TRISHA CABILDO
+
+
+# Continuous wavelet transform of captured LTC2387 data, done in the frequency domain.
+#
+# scipy.signal.cwt convolves the whole capture with every scaled wavelet directly, which for 256k
+# samples and a few dozen scales takes minutes. Here every scale is an FFT multiply instead:
+#   - the capture is cut into overlap-save blocks, so captures of any length (including memory-mapped
+#     ones from capture_store) are processed in constant memory and each block's FFT is shared by all scales
+#   - the spectrum of each scaled Ricker kernel is cached, so repeated captures reuse it
+#   - scales can be spread over a thread pool; the FFTs release the GIL
+# The result matches scipy.signal.cwt(data, ricker, widths) to floating point rounding, for integer
+# and non-integer widths alike.
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+from scipy import fft
+from scipy.signal import ricker
+
+cwt_block = 65536                                                                               #Output samples per overlap-save block
+kernel_cache_size = 256                                                                         #Kernel spectra kept between captures
+
+def kernel_points(width, n_data):
+    # Same rule as scipy.signal.cwt, which passes min(10 * width, n_data) to ricker() unrounded.
+    # For a non-integer width the kernel then has ceil(points) samples, centred on (points - 1) / 2.
+    return min(10 * width, n_data)
+
+def kernel_length(points):
+    # Number of samples ricker(points, width) returns: len(np.arange(0, points))
+    return int(np.ceil(points))
+
+@lru_cache(maxsize=kernel_cache_size)
+def kernel_spectrum(width, points, nfft):
+    # The wavelet is time-reversed for a correlation, exactly as scipy.signal.cwt does
+    kernel = ricker(points, width)[::-1]
+    spectrum = fft.rfft(kernel, nfft)
+    spectrum.setflags(write=False)
+    return spectrum
+
+def fft_cwt(data, widths, block=cwt_block, workers=1, out=None):
+    # data - 1-D capture (array or memmap), widths - Ricker width parameters as for scipy.signal.cwt.
+    # workers - threads to spread the scales over. out - optional (len(widths), len(data)) array to fill,
+    # e.g. an np.memmap for very long captures.
+    n_data = len(data)
+    widths = list(widths)
+    if out is None:
+        out = np.empty((len(widths), n_data))
+
+    points = [kernel_points(w, n_data) for w in widths]
+    lengths = [kernel_length(p) for p in points]
+    delays = [(length - 1) // 2 for length in lengths]                                          #'same' mode centering
+    pre = max(lengths) - 1
+    nfft = fft.next_fast_len(block + pre + max(delays))
+    block = nfft - pre - max(delays)                                                            #Use the slack next_fast_len left over
+    """Overlap-save bookkeeping. Each FFT segment starts pre samples before the block it produces, so
+    every scale's kernel sees its full history, and runs long enough to cover the 'same' mode delay of
+    the widest kernel. One segment FFT then serves every scale."""
+
+    def one_scale(i, spectrum, start, n):
+        y = fft.irfft(spectrum * kernel_spectrum(widths[i], points[i], nfft), nfft)
+        first = pre + delays[i]
+        out[i, start:start + n] = y[first:first + n]
+
+    segment = np.zeros(nfft)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, n_data, block):
+            n = min(block, n_data - start)
+            lo = start - pre
+            segment[:] = 0.0
+            src = data[max(lo, 0):min(lo + nfft, n_data)]
+            segment[max(-lo, 0):max(-lo, 0) + len(src)] = src
+            spectrum = fft.rfft(segment)
+            list(pool.map(lambda i: one_scale(i, spectrum, start, n), range(len(widths))))
+
+    return out
@@ -7,6 +7,8 @@ Created on Mon Dec  5 16:36:39 2022
 
 
 import math
+from fractions import Fraction
+from functools import lru_cache
 
 from scipy.signal import periodogram,find_peaks,ricker, resample
 import matplotlib.pyplot as plt
@@ -18,9 +20,13 @@ from scipy import signal
 import numpy as np
 import os
 import sys
+import time
+import queue
+import threading
 #print("Python Packages Import done")
 
 import libm2k
+from wavelet_gen import lod_plot, put_unless_stopped
 #print("ADI Packages Import done")
 
 def wav_init():
@@ -131,9 +137,7 @@ def wavdiff_out(ctx):
     w1_data = rnd_ricker +vcm
     w2_data = vcm-rnd_ricker
 
-    plt.plot(w1_data)
-    plt.plot(w2_data)
-    plt.plot(w1_data-w2_data)
+    lod_plot(plt.gca(), [w1_data, w2_data, w1_data-w2_data])
     plt.show()
 
     buffer = [w1_data, w2_data]
@@ -146,6 +150,68 @@ def wavdiff_out(ctx):
     print("Wavelet Generated")
 
 
+#Pipelined version of the wavdiff_out() loop. A worker thread keeps the next few differential
+#buffers ready in a bounded queue while the main thread does nothing but push them, so the loop
+#runs at the rate the M2K accepts buffers instead of the rate we can compute and plot them.
+queue_depth = 4                     #Buffers computed ahead of the device
+show_plots = False                  #Plot each waveform after it is pushed (non-blocking)
+
+def wavdiff_buffers():
+    rnd_ricker = random_ricker()
+    return [rnd_ricker + vcm, vcm - rnd_ricker]
+
+def wav_producer(buffers, stop):
+    #If generation fails, the exception is queued in place of a buffer for wavdiff_stream to re-raise
+    try:
+        while not stop.is_set():
+            if not put_unless_stopped(buffers, wavdiff_buffers(), stop):
+                return
+    except Exception as e:
+        put_unless_stopped(buffers, e, stop)
+
+def wav_setup_out(ctx):
+    #Configure the analog output once, instead of on every waveform
+    aout=ctx.getAnalogOut()
+    aout.setSampleRate(0, sr)
+    aout.setSampleRate(1, sr)
+    aout.enableChannel(0, True)
+    aout.enableChannel(1, True)
+    aout.setCyclic(False)
+    return aout
+
+def plot_diff(w1_data, w2_data):
+    plt.clf()
+    lod_plot(plt.gca(), [w1_data, w2_data, w1_data-w2_data])
+    plt.pause(0.001)
+
+def wavdiff_stream(ctx, depth=queue_depth, plot=show_plots, count=None):
+    aout = wav_setup_out(ctx)
+    buffers = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    producer = threading.Thread(target=wav_producer, args=(buffers, stop), daemon=True)
+    producer.start()
+
+    pushed = 0
+    start = time.perf_counter()
+    try:
+        while count is None or pushed < count:
+            buffer = buffers.get()
+            if isinstance(buffer, Exception):
+                raise buffer
+            aout.push(buffer)
+            pushed += 1
+            if plot:
+                plot_diff(*buffer)
+            if pushed % 10 == 0:
+                elapsed = time.perf_counter() - start
+                print("%d wavelets, %.2f wavelets/s, %d ready" % (pushed, pushed/elapsed, buffers.qsize()))
+    finally:
+        stop.set()
+        producer.join()
+
+    return pushed
+
+
 
 available_sample_rates= [750, 7500, 75000, 750000, 7500000, 75000000]
 max_rate = available_sample_rates[-1] # last sample rate = max rate
@@ -153,62 +219,98 @@ min_nr_of_points=10
 max_buffer_size = 500000
 
 def get_best_ratio(ratio):
+    #Find the whole number of periods whose length in samples is closest to a whole number,
+    #using at most max_buffer_size samples. Instead of trying every period count, walk the continued
+    #fraction of ratio: its convergents p/q are the best such approximations there are, and the last
+    #one with q inside the limit is the answer. That takes a few dozen steps instead of up to 500k.
     max_it=max_buffer_size/ratio
-    best_ratio=ratio
-    best_fract=1
-
-    for i in range(1,int(max_it)):
-        new_ratio = i*ratio
-        (new_fract, integral) = math.modf(new_ratio)
-        if new_fract < best_fract:
-            best_fract = new_fract
-            best_ratio = new_ratio
-        if new_fract == 0:
+    if int(max_it) < 2:
+        return ratio,1
+
+    x = Fraction(ratio)                 #Exact value of the float, so the expansion terminates
+    p0, q0, p1, q1 = 0, 1, 1, 0         #Convergents p/q, previous and current
+    while True:
+        a = math.floor(x)
+        p0, q0, p1, q1 = p1, q1, a*p1 + p0, a*q1 + q0
+        if q1 >= int(max_it):
+            p1, q1 = p0, q0
             break
+        if x == a:
+            break
+        x = 1/(x - a)
 
+    best_ratio = p1                     #Samples in the buffer
+    best_fract = abs(q1*ratio - p1)     #Samples left over at the wrap - error
     return best_ratio,best_fract
 
-
-def get_samples_count(rate, freq):
+@lru_cache(maxsize=None)
+def plan_samples(rate, freq):
+    #Memoized buffer plan for one (rate, freq) pair: (rate, buffer size, phase error at the buffer
+    #wrap in microseconds), or None if the rate cannot produce freq.
     ratio = rate/freq
     if ratio<min_nr_of_points and rate < max_rate:
-        return 0
+        return None
     if ratio<2:
-        return 0
+        return None
 
     ratio,fract = get_best_ratio(ratio)
-    # ratio = number of periods in buffer
+    # ratio = number of samples in buffer, a whole number of periods
     # fract = what is left over - error
 
-    size=int(ratio)
+    size=int(round(ratio))
     while size & 0x03:
         size=size<<1
     while size < 1024:
         size=size<<1
-    return size
+    # The buffer repeats the ratio-sample pattern size/ratio times, and the error adds up over every
+    # repeat, so the phase error at the wrap is that many times fract. The doubling to a multiple of 4
+    # can also take size up to 4 * max_buffer_size; get_best_ratio's limit is on the pattern only.
+    return rate, size, fract * (size // int(round(ratio))) / rate * 1e6
 
-def get_optimal_sample_rate(freq):
+def get_samples_count(rate, freq):
+    plan = plan_samples(rate, freq)
+    if plan is None:
+        return 0
+    return plan[1]
+
+@lru_cache(maxsize=None)
+def plan_tone(freq):
+    #Lowest usable sample rate for freq, with its buffer size and phase error (see plan_samples)
     for rate in available_sample_rates:
-        buf_size = get_samples_count(rate,freq)
-        if buf_size:
-            return rate
+        plan = plan_samples(rate, freq)
+        if plan is not None:
+            return plan
 
-def sine_buffer_generator(channel, freq, ampl, offset, phase):
+def get_optimal_sample_rate(freq):
+    plan = plan_tone(freq)
+    if plan is not None:
+        return plan[0]
+
+sine_cache_size = 64                #Tone buffers kept ready for reuse
+
+@lru_cache(maxsize=sine_cache_size)
+def sine_buffer(rate, freq, ampl, offset, phase):
+    #Contiguous float64 sine buffer for one tone, computed in place with NumPy. Cached per
+    #(rate, freq, ampl, offset, phase) and returned read-only, so stepping back to a tone that was
+    #already played costs nothing.
+    nr_of_samples = get_samples_count(rate, freq)
+    samples_per_period = rate / freq
+    phase_in_samples = ((phase/360) * samples_per_period)
 
-    buffer = []
+    buffer = np.arange(nr_of_samples, dtype=np.float64)
+    buffer += phase_in_samples
+    buffer *= 2*math.pi / samples_per_period
+    np.sin(buffer, out=buffer)
+    buffer *= ampl
+    buffer += offset
+    buffer.setflags(write=False)
 
-    sample_rate = get_optimal_sample_rate(freq)
-    nr_of_samples = get_samples_count(sample_rate, freq)
-    samples_per_period = sample_rate / freq
-    phase_in_samples = ((phase/360) * samples_per_period)
+    return buffer
 
-    #print("sample_rate:",sample_rate)
-    #print("number_of_samples",nr_of_samples)
-    #print("samples_per_period",samples_per_period)
-    #print("phase_in_samples",phase_in_samples)
+def sine_buffer_generator(channel, freq, ampl, offset, phase):
 
-    for i in range(nr_of_samples):
-        buffer.append(offset + ampl * (math.sin(((i + phase_in_samples)/samples_per_period) * 2*math.pi) ))
+    sample_rate = get_optimal_sample_rate(freq)
+    buffer = sine_buffer(sample_rate, freq, ampl, offset, phase)
 
     return sample_rate, buffer
 
@@ -240,6 +342,6 @@ def sine_1k_out(ctx):
 
 
 
-ctx = wav_init()
-while(True):
-    wavdiff_out(ctx)
\ No newline at end of file
+if __name__ == '__main__':
+    ctx = wav_init()
+    wavdiff_stream(ctx)
\ No newline at end of file
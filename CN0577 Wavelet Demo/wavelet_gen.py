@@ -34,8 +34,12 @@
 # AUTHOR: TRISHA CABILDO
 
 import sys
+import time
+import queue
+import threading
 import libm2k
 import numpy as np
+from functools import lru_cache
 from scipy.signal import periodogram,find_peaks,ricker, resample
 import matplotlib.pyplot as plt
 
@@ -45,12 +49,21 @@ N = 750000                                                      # Number of samp
 t = np.arange(0,1,1/N)
 vcm = 2.048                                                     # VCM of LT2387 (2.048 V default)
 l, h = 0, 0.005
+noise_sigma = 0.001                                             # RMS volts for the "gaussian" noise model
+noise_rng = np.random.default_rng()
 
 available_sample_rates= [750, 7500, 75000, 750000, 7500000, 75000000]
 max_rate = available_sample_rates[-1]                           # last sample rate = max rate
 min_nr_of_points=10
 max_buffer_size = 500000
 
+wavelet_cache_size = 16                                         # Normalized wavelets kept in memory (375k points = 3 MB each)
+width_levels = 200                                              # Random wavelet widths are drawn from this many grid steps
+wavelet_bank = {}                                               # (n_points, width) -> row of a preloaded, memory-mapped bank
+synth_buffers = {}                                              # (shape, dtype) -> buffer reused by diff_synth/add_noise
+plot_points = 2000                                              # Min/max pairs drawn per series, about one per screen pixel
+stream_prefetch = 3                                             # Chunks prepared ahead of the device when streaming
+
 def wav_init():
     ctx=libm2k.m2kOpen()
     if ctx is None:
@@ -64,47 +77,68 @@ def wav_close(ctx):
     libm2k.contextClose(ctx)
     del ctx
 
+@lru_cache(maxsize=wavelet_cache_size)
+def norm_ricker(n_points, width):
+    # Ricker wavelet rescaled to span exactly 0..1, and its mean. Every wavelet this module generates is
+    # a scale and an offset of one of these, so each (n_points, width) pair is only computed once.
+    # The arrays are shared between callers and marked read-only.
+    x = wavelet_bank.get((n_points, width))
+    if x is None:
+        x = ricker(n_points, width)
+        x -= np.min(x)
+        x /= np.max(x)
+        x.setflags(write=False)
+    return x, float(np.mean(x))
+
+def random_width(n_points):
+    # Same distribution as the original int(n_points * 0.05 * rand) * rand, snapped to a grid of
+    # width_levels steps so that random wavelets can come out of the cache (or a preloaded bank)
+    max_width = n_points * 0.05
+    width = int(max_width * np.random.random()) * np.random.random()
+    level = max(1, int(round(width / max_width * width_levels)))
+    return max_width * level / width_levels
+
+def preload_bank(path, n_points=int(N/2)):
+    # Writes every grid width for n_points into a memory-mapped .npy file (float32, about 300 MB for
+    # the default 375k points), then loads it. Run once; later sessions just call load_bank(path).
+    max_width = n_points * 0.05
+    bank = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(width_levels, n_points))
+    for level in range(1, width_levels + 1):
+        x = ricker(n_points, max_width * level / width_levels)
+        x -= np.min(x)
+        x /= np.max(x)
+        bank[level - 1] = x
+    bank.flush()
+    del bank
+    load_bank(path)
+
+def load_bank(path):
+    bank = np.load(path, mmap_mode="r")
+    levels, n_points = bank.shape
+    max_width = n_points * 0.05
+    for level in range(1, levels + 1):
+        wavelet_bank[(n_points, max_width * level / levels)] = bank[level - 1]
+    norm_ricker.cache_clear()
+
 def random_ricker():
     vpp = 0.5                                                    # Peak to peak amplitude of wavelet
     n_peak = 2                                                   # Number of wavelet peaks
     n_points = int(N/n_peak)                                     # Number of points per wavelet
     
-    width_param = int(n_points * 0.05 * np.random.random())      # 5% width parameter; Randomizes the width of the wavelet                                             
-    x = ricker(n_points, width_param * np.random.random())       # Generate wavelet
-    v_scale = vpp/(np.max(x)-np.min(x))/2                        # Scale to fit vpp
-    x = x * v_scale
-    rick_offset = 0 - np.min(x)                             
-    x = x + rick_offset
-
-    if n_peak > 1:
-        ricker_wav = np.concatenate((x,x))
-        for _ in range(1,n_peak-1):
-            ricker_wav= np.concatenate((ricker_wav,x))
-    else:
-        ricker_wav = x
-
-    return x - np.average(x)
+    x, x_avg = norm_ricker(n_points, random_width(n_points))     # 5% width parameter; Randomizes the width of the wavelet
+    v_scale = vpp/2                                              # Scale to fit vpp
+
+    return (x - x_avg) * v_scale
 
 def ricker_gen():
     vpp =  0.5                              
     n_peak= 2                               
     n_points = int(N/n_peak)                
     width_param = int(n_points*.05)         
-    vcm = 2.048                             
-    x = ricker(n_points,width_param)        
-    v_scale = vpp/(np.max(x)-np.min(x))/2   
-    x = x*v_scale
-    rick_offset = 0 - np.min(x)
-    x = x + rick_offset
-
-    if n_peak > 1:
-        ricker_wav = np.concatenate((x,x))
-        for _ in range(1,n_peak-1):
-            ricker_wav= np.concatenate((ricker_wav,x))
-    else:
-        ricker_wav = x
-
-    return ricker_wav
+    x, _ = norm_ricker(n_points, width_param)
+    v_scale = vpp/2
+
+    return np.tile(x * v_scale, n_peak)
 
 def wavsingle_out(ctx, ricker_wav):
     aout=ctx.getAnalogOut()
@@ -126,6 +160,47 @@ def wavsingle_out(ctx, ricker_wav):
     aout.push(buffer)
     print("Wavelet Generated")
 
+def synth_buffer(shape, dtype, tag):
+    key = (tag, shape, np.dtype(dtype))
+    buf = synth_buffers.get(key)
+    if buf is None:
+        buf = np.empty(shape, dtype=dtype)
+        synth_buffers[key] = buf
+    return buf
+
+def add_noise(w1, w2, model="uniform"):
+    # Adds independent noise to each channel in place. "uniform" is l..h volts (the original noise_add),
+    # "gaussian" is zero mean with noise_sigma RMS. The noise is drawn straight into a reused scratch
+    # buffer sized from the waveform, so no full-length temporaries are created.
+    if model is None:
+        return w1, w2
+    scratch = synth_buffer(w1.shape, w1.dtype, "noise")
+    for w in (w1, w2):
+        if model == "uniform":
+            noise_rng.random(out=scratch, dtype=scratch.dtype)
+            scratch *= h - l
+            scratch += l
+        elif model == "gaussian":
+            noise_rng.standard_normal(out=scratch, dtype=scratch.dtype)
+            scratch *= noise_sigma
+        else:
+            raise ValueError("Unknown noise model: %s" % model)
+        w += scratch
+    return w1, w2
+
+def diff_synth(wav, noise=None, dtype=np.float64, out=None):
+    # Differential P/N pair around vcm, written straight into preallocated buffers: P = vcm + wav,
+    # N = vcm - wav, each with optional noise (see add_noise). Without out=, the same (2, len(wav))
+    # buffer is reused by every call of that length and dtype, so copy the result if it has to outlive
+    # the next call.
+    if out is None:
+        out = synth_buffer((2, len(wav)), dtype, "diff")
+    w1, w2 = out[0], out[1]
+    np.add(wav, vcm, out=w1)
+    np.subtract(vcm, wav, out=w2)
+    add_noise(w1, w2, noise)
+    return w1, w2
+
 def wavdiff_out(ctx):
     aout = ctx.getAnalogOut()
     aout.setSampleRate(0, sr)
@@ -134,8 +209,7 @@ def wavdiff_out(ctx):
     aout.enableChannel(1, True)
     
     rnd_ricker = random_ricker()
-    w1_data = rnd_ricker + vcm
-    w2_data = vcm - rnd_ricker
+    w1_data, w2_data = diff_synth(rnd_ricker)
 
     buffer = [w1_data, w2_data]
     aout.setCyclic(True)
@@ -144,17 +218,143 @@ def wavdiff_out(ctx):
 
     return w1_data, w2_data
 
+def iter_chunks(source, chunk_size=max_buffer_size):
+    # Cut a differential waveform into device-sized [w1, w2] chunks. source is either a (w1, w2) pair of
+    # arrays of any length, which is sliced without copying, or an iterable that yields (w1, w2) blocks of
+    # any size as they are generated; those are regrouped into full chunks. The last chunk may be short.
+    if isinstance(source, tuple) and len(source) == 2 and np.ndim(source[0]) == 1:
+        w1, w2 = source
+        for start in range(0, len(w1), chunk_size):
+            yield [w1[start:start + chunk_size], w2[start:start + chunk_size]]
+        return
+
+    chunk = np.empty((2, chunk_size))
+    fill = 0
+    for w1, w2 in source:
+        done = 0
+        while done < len(w1):
+            n = min(chunk_size - fill, len(w1) - done)
+            chunk[0, fill:fill + n] = w1[done:done + n]
+            chunk[1, fill:fill + n] = w2[done:done + n]
+            fill += n
+            done += n
+            if fill == chunk_size:
+                yield [chunk[0], chunk[1]]
+                chunk = np.empty((2, chunk_size))                # The queued chunk must not be overwritten
+                fill = 0
+    if fill:
+        yield [chunk[0, :fill], chunk[1, :fill]]
+
+def put_unless_stopped(chunks, item, stop):
+    # Blocking put that gives up once stop is set, so a producer is never stuck on a full queue
+    # after the consumer has gone away.
+    while not stop.is_set():
+        try:
+            chunks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def chunk_producer(source, chunk_size, chunks, errors, stop):
+    try:
+        for chunk in iter_chunks(source, chunk_size):
+            if not put_unless_stopped(chunks, chunk, stop):
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        put_unless_stopped(chunks, None, stop)                   # End of stream
+
+def stream_out(ctx, source, chunk_size=max_buffer_size, prefetch=stream_prefetch):
+    # Play a waveform of any length (or one generated on the fly, see iter_chunks) as a sequence of
+    # non-cyclic pushes. A worker thread keeps up to prefetch chunks ready. An underrun is counted each
+    # time the device is ready for the next chunk and none is waiting - on the wire, that is a gap.
+    aout = ctx.getAnalogOut()
+    aout.setSampleRate(0, sr)
+    aout.setSampleRate(1, sr)
+    aout.enableChannel(0, True)
+    aout.enableChannel(1, True)
+    aout.setCyclic(False)
+
+    chunks = queue.Queue(maxsize=prefetch)
+    errors = []
+    stop = threading.Event()
+    producer = threading.Thread(target=chunk_producer, args=(source, chunk_size, chunks, errors, stop), daemon=True)
+    producer.start()
+
+    n_chunks, n_samples, underruns = 0, 0, 0
+    try:
+        chunk = chunks.get()                                     # Priming the pipeline is not an underrun
+        start = time.perf_counter()
+        while chunk is not None:
+            aout.push(chunk)
+            n_chunks += 1
+            n_samples += len(chunk[0])
+            try:
+                chunk = chunks.get_nowait()
+            except queue.Empty:
+                chunk = chunks.get()
+                if chunk is not None:                            # Waiting for the end-of-stream marker is not an underrun
+                    underruns += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        stop.set()                                               # Only matters if push() raised
+        while True:                                              # Free the queued chunks, and a producer blocked on put
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                break
+        producer.join()
+    if errors:
+        raise errors[0]
+
+    stats = {"chunks": n_chunks,
+             "samples": n_samples,
+             "underruns": underruns,
+             "elapsed": elapsed,
+             "sample_rate": n_samples / elapsed if elapsed > 0 else 0.0}
+    print("Streamed %d samples in %d chunks, %d underruns, %.3f MS/s sustained (device rate %.3f MS/s)"
+          % (n_samples, n_chunks, stats["underruns"], stats["sample_rate"]/1e6, sr/1e6))
+    return stats
+
+def minmax_envelope(y, start, stop, n_points=plot_points):
+    # Reduce y[start:stop] to n_points bins, drawn as a vertical stroke from each bin's min to its max.
+    # Every peak survives, which plain decimation would not guarantee. Short ranges are returned as is.
+    # Only the requested range is read, so y can be a memory-mapped capture.
+    seg = np.asarray(y[start:stop])
+    if len(seg) <= 2 * n_points:
+        return np.arange(start, start + len(seg)), seg
+    edges = np.linspace(0, len(seg), n_points + 1).astype(np.intp)[:-1]
+    x = np.repeat(start + edges, 2)
+    env = np.empty(2 * n_points, dtype=seg.dtype)
+    env[0::2] = np.minimum.reduceat(seg, edges)
+    env[1::2] = np.maximum.reduceat(seg, edges)
+    return x, env
+
+def lod_plot(ax, series, n_points=plot_points):
+    # Plot long series as min/max envelopes, and recompute them for the visible range whenever the
+    # view is zoomed or panned, so detail appears as you zoom in.
+    lengths = [len(y) for y in series]
+    lines = [ax.plot(*minmax_envelope(y, 0, len(y), n_points))[0] for y in series]
+
+    def refresh(ax):
+        lo, hi = ax.get_xlim()
+        for y, n, line in zip(series, lengths, lines):
+            start = min(max(int(np.floor(lo)), 0), n)
+            stop = min(max(int(np.ceil(hi)) + 1, start), n)
+            line.set_data(*minmax_envelope(y, start, stop, n_points))
+
+    ax.callbacks.connect("xlim_changed", refresh)
+    return lines
+
 def plotter(w1_data, w2_data):
-    plt.plot(w1_data)
-    plt.plot(w2_data)
-    plt.plot(w1_data-w2_data)
+    fig, ax = plt.subplots()
+    lod_plot(ax, [w1_data, w2_data, w1_data-w2_data])
     plt.show()
 
 def noise_add(w1, w2):
-    s1 = np.random.uniform(low = l, high = h, size = 375000)
-    s2 = np.random.uniform(low = l, high = h, size = 375000)
-    w1 += s1
-    w2 += s2
+    add_noise(w1, w2, "uniform")
     print("Noisy wavelet generated!")
 
     return w1, w2
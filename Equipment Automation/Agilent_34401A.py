@@ -7,13 +7,15 @@ Created on Thu Aug  6 08:57:44 2020
 
 #This is a control code for the Chroma Supply.Code contains functions commonly used.
 
-import pyvisa as visa
+import time
+import numpy as np
+from scpi_session import scpi_session, resource_manager
 
-rm = visa.ResourceManager()
-print(rm.list_resources())
+max_readings = 512                  #Size of the 34401A reading memory
+line_freq = 50                      #Mains frequency, sets the length of one NPLC
 
 #Setting the instrument name
-meter = rm.open_resource('GPIB0::21::INSTR')
+meter = scpi_session('GPIB0::21::INSTR', timeout=5000)
 
 #Function to set supply ON
 def ON_power ():
@@ -30,17 +32,62 @@ def set_remote():
     print("Remote good!")
     return None
 
-#Function to set supply OFF
+#Function to fetch DC voltage and current, in one bus transaction
 def fetch_out():
-    meter.query('MEASure:VOLTage:DC?')
-    meter.query('MEASure:CURRent:DC?')
-    return None
+    v, c = meter.query_values('MEASure:VOLTage:DC?', 'MEASure:CURRent:DC?')
+    return v, c
+
+#Function to set up buffered DC voltage acquisition. The meter is configured once - fixed range,
+#fixed integration time, autozero and display off, no trigger delay - so every reading after this is
+#just a conversion. trigger_count * sample_count readings (up to 512) are taken per READ?/FETCh?.
+def configure_buffered(sample_count, v_range=10, nplc=0.02, trigger_count=1):
+    if sample_count * trigger_count > max_readings:
+        raise ValueError("34401A memory holds at most %d readings" % max_readings)
+    meter.write('CONFigure:VOLTage:DC %g' % v_range,
+                'VOLTage:DC:NPLCycles %g' % nplc,
+                'ZERO:AUTO OFF',
+                'TRIGger:SOURce IMMediate',
+                'TRIGger:DELay 0',
+                'TRIGger:COUNt %d' % trigger_count,
+                'SAMPle:COUNt %d' % sample_count,
+                'DISPlay OFF')
+    meter.wait_opc()
+    return sample_count * trigger_count, nplc
+
+#Function to take one buffer of readings set up by configure_buffered(). READ? streams the readings
+#straight out; fetch=True instead runs INIT, waits for completion and pulls them from reading memory
+#with FETCh?. Either way the whole buffer comes back in one transfer. Returns the readings as a NumPy
+#array and the achieved readings per second.
+def read_buffered(n_readings, nplc, fetch=False):
+    timeout = int(2000 + 2 * 1000 * n_readings * max(nplc, 0.02) / line_freq)   #Twice the expected time, plus margin
+    start = time.perf_counter()
+    saved = meter.timeout
+    meter.timeout = timeout
+    try:
+        if fetch:
+            meter.write('INITiate')
+            meter.wait_opc()
+            text = meter.query('FETCh?')
+        else:
+            text = meter.query('READ?')
+    finally:
+        meter.timeout = saved
+    elapsed = time.perf_counter() - start
+
+    readings = np.array(text.split(','), dtype=np.float64)
+    rate = len(readings) / elapsed
+    print("%d readings, %.1f readings/s" % (len(readings), rate))
+    return readings, rate
 
 def beeper():
-    meter.write('SYSTem:BEEPer')
-    meter.write('SYSTem:BEEPer:STATe ON')
+    meter.write('SYSTem:BEEPer', 'SYSTem:BEEPer:STATe ON')
 
-set_remote()
-beeper()
-OFF_power()
-#print(dmm_id())
+if __name__ == '__main__':
+    print(resource_manager().list_resources())
+    set_remote()
+    beeper()
+    n, nplc = configure_buffered(max_readings)
+    readings, rate = read_buffered(n, nplc)
+    print("Mean %.6f V, std %.2e V" % (np.mean(readings), np.std(readings)))
+    OFF_power()
+    #print(dmm_id())
@@ -7,14 +7,21 @@ Created on Thu Aug  6 08:57:44 2020
 
 #This is a control code for the Chroma Supply.Code contains functions commonly used.
 
-import pyvisa as visa
 import time
+import numpy as np
+from scpi_session import scpi_session, resource_manager
+from settling import wait_stable, wait_until
 
-rm = visa.ResourceManager()
-print(rm.list_resources())
+settle_tol = 0.01                   #Volts; readback is settled once settle_count readings agree this closely
+settle_count = 3
+settle_interval = 0.1               #Seconds between settling readbacks
+settle_timeout = 5.0                #Seconds
+readback_accuracy = 0.1             #Volts; 62000P measurement error is tens of mV at 12 V
+
+max_program_steps = 100            #Sequences per program on the 62000P
 
 #Setting the instrument name
-supply = rm.open_resource('USB0::0x1698::0x0837::005000001044::INSTR')
+supply = scpi_session('USB0::0x1698::0x0837::005000001044::INSTR', timeout=2000)
 
 #Function to set supply ON
 def ON_power ():
@@ -26,25 +33,87 @@ def OFF_power():
     supply.write('ABORt')
     return None
 
-#Function to set output voltage and current
+#Function to set output voltage and current, in one bus transaction
 def set_out (v, c):
     voltage = "SOUR:VOLT " + str(v)
     curr = "SOUR:CURR " + str(c)
-    supply.write(voltage)
-    supply.write(curr)
-    supply.write('SOUR:CURR:LIMIT:HIGH 2.5')
+    supply.write(voltage, curr, 'SOUR:CURR:LIMIT:HIGH 2.5')
+    supply.wait_opc()
     return None
 
-#Funtion to fetch supply measurements
+#Function to wait for the output to settle, returns the settled voltage. Pass the v given to set_out()
+#as target whenever it is known, so the old output level is not mistaken for a settled one.
+def settle_out(target=None, tolerance=settle_tol, count=settle_count, timeout=settle_timeout,
+               interval=settle_interval):
+    return wait_stable(lambda: float(supply.query('FETC:VOLT?')), tolerance, count, timeout, interval, target,
+                       readback_accuracy)
+
+#Funtion to fetch supply measurements, in one bus transaction
 def fetch_supply_out ():
-    v = supply.query('FETC:VOLT?')
-    c = supply.query('FETC:CURR?')
-    p = supply.query('FETC:POW?')
+    v, c, p = supply.query_fields('FETC:VOLT?', 'FETC:CURR?', 'FETC:POW?')
     return v,c,p
 
-set_out(12.0, 2.5)
-ON_power()
-time.sleep(2)
-print(fetch_supply_out())
-time.sleep(2)
-OFF_power
+#Function to upload a whole sweep to the supply's program (list) mode in one bus transaction.
+#steps is a list of (voltage, current, dwell seconds); each becomes one AUTO sequence, so the supply
+#steps through them on its own clock.
+def upload_program(steps, program=1):
+    if len(steps) > max_program_steps:
+        raise ValueError("A program holds at most %d steps" % max_program_steps)
+    commands = ['PROGram:SELected %d' % program,
+                'PROGram:CLEar',
+                'PROGram:LINK 0',
+                'PROGram:COUNt 1']
+    for seq, (v, c, dwell) in enumerate(steps, 1):
+        commands += ['PROGram:SEQuence:SELected %d' % seq,
+                     'PROGram:SEQuence:TYPE AUTO',
+                     'PROGram:SEQuence:VOLTage %g' % v,
+                     'PROGram:SEQuence:CURRent %g' % c,
+                     'PROGram:SEQuence:TIME %g' % dwell]
+    supply.write(*commands)
+    supply.wait_opc()
+    return None
+
+#Function to run an uploaded program and collect readbacks. The supply does the stepping; the host
+#only takes one compound V/I/P reading at the middle of each step's dwell, so the sweep takes as long
+#as its dwell times add up to. Returns an (n_steps, 3) array of voltage, current and power.
+#Readings are host-timed, so each one is checked to have finished inside its own step. If the bus was
+#too slow for the dwell time, the program is stopped and a TimeoutError says which step slipped.
+def run_program(steps, readback=True):
+    readings = []
+    supply.write('PROGram:RUN ON')
+    start = time.perf_counter()
+    t_step = 0.0
+    for i, (v, c, dwell) in enumerate(steps):
+        if readback:
+            delay = start + t_step + dwell/2 - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            readings.append(supply.query_values('FETC:VOLT?', 'FETC:CURR?', 'FETC:POW?'))
+            done = time.perf_counter() - start
+            if done > t_step + dwell:
+                supply.write('PROGram:RUN OFF')
+                raise TimeoutError("Readback for step %d finished %.3f s into the program, after the step ended "
+                                   "at %.3f s; use longer dwell times" % (i + 1, done, t_step + dwell))
+        t_step += dwell
+    wait_until(lambda: supply.query('PROGram:RUN?').upper() in ('0', 'OFF'),
+               timeout=t_step + settle_timeout, interval=0.05)
+    return np.array(readings)
+
+#Function for a complete hardware-timed sweep: upload, run, read back. The output is switched off
+#afterwards even if the run fails.
+def sweep_out(steps, program=1):
+    upload_program(steps, program)
+    ON_power()
+    try:
+        readings = run_program(steps)
+    finally:
+        OFF_power()
+    return readings
+
+if __name__ == '__main__':
+    print(resource_manager().list_resources())
+    set_out(12.0, 2.5)
+    ON_power()
+    settle_out(12.0)
+    print(fetch_supply_out())
+    OFF_power()
@@ -23,10 +23,19 @@
 # THE SOFTWARE.
 
 from pyvirtualbench import PyVirtualBench, PyVirtualBenchException, DmmFunction
-import time
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from settling import wait_stable
 
 device_name = 'VB8012-32C3456'
 channel = "ps/+25V"
+settle_tol = 0.005      # Readings are settled once settle_count in a row agree this closely (V)
+settle_count = 3
+settle_interval = 0.1   # Seconds between readings
+settle_timeout = 5.0    # Seconds
+readback_accuracy = 0.05 # Volts; readbacks this close to the setpoint count as having left the old level
 
 # Replace "myVirtualBench" with the name of your device. The device name is the model number and serial number separated by a hyphen; e.g., "VB8012-309738A".
 # Check the device's name in the VirtualBench Application under File->About
@@ -37,7 +46,8 @@ def VB_setup():
 def set_DC_out(my_supply,chx, v, c):
     my_supply.configure_voltage_output(chx,v,c)
     my_supply.enable_all_outputs(True)
-    time.sleep(2)
+    wait_stable(lambda: my_supply.read_output(chx)[0], settle_tol, settle_count, settle_timeout, settle_interval,
+                target=v, accuracy=readback_accuracy)
     return
 
 def print_DC_out(my_supply,chx):
@@ -47,9 +57,9 @@ def print_DC_out(my_supply,chx):
 
 def dmm_volt_read(dmm):
     dmm.configure_measurement(DmmFunction.DC_VOLTS, True, 20.0)
-    time.sleep(2)
-    print("DMM Measurement: %f V" % (dmm.read()))
-    return
+    reading = wait_stable(dmm.read, settle_tol, settle_count, settle_timeout, settle_interval)
+    print("DMM Measurement: %f V" % (reading))
+    return reading
 
 def main():
     try:
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent multi-instrument orchestration with asyncio.
+
+@author: tcabildo
+"""
+
+#The driver functions block on pyvisa/pyvirtualbench I/O. Each instrument gets its own single-thread
+#executor (a "lane"): calls to one instrument still run one after another, in the order they were
+#issued, but calls to different instruments overlap. A setpoint on the supply and a reading on the
+#DMM then cost the slower of the two instead of their sum.
+
+import asyncio
+import functools
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import Chroma_6200 as chroma
+import Agilent_34401A as agilent
+
+#NI-Supply.py is not an importable module name, so load it from its path
+_spec = importlib.util.spec_from_file_location(
+    "ni_supply", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Virtualbench", "NI-Supply.py"))
+ni_supply = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(ni_supply)
+
+class instrument_lane():
+    """
+    Serial executor for one instrument.
+
+    Methods:
+        call - run a blocking driver function on this instrument's thread and await its result
+        close - shut the thread down once queued calls have finished
+    """
+    def __init__(self, name):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    async def call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+lanes = {
+    "chroma": instrument_lane("chroma"),
+    "agilent": instrument_lane("agilent"),
+    "virtualbench": instrument_lane("virtualbench"),        #Supply and DMM share one device, so one lane
+}
+
+#Async wrappers for the driver functions
+async def set_out(v, c):
+    return await lanes["chroma"].call(chroma.set_out, v, c)
+
+async def set_and_settle(v, c):
+    #*OPC? only says the command was parsed; settle_out waits for the output to actually get there.
+    #Both run on the chroma lane, so they still overlap with the other instruments.
+    await lanes["chroma"].call(chroma.set_out, v, c)
+    return await lanes["chroma"].call(chroma.settle_out, v)
+
+async def fetch_supply_out():
+    return await lanes["chroma"].call(chroma.fetch_supply_out)
+
+async def fetch_out():
+    return await lanes["agilent"].call(agilent.fetch_out)
+
+async def set_DC_out(my_supply, chx, v, c):
+    return await lanes["virtualbench"].call(ni_supply.set_DC_out, my_supply, chx, v, c)
+
+async def dmm_volt_read(dmm):
+    return await lanes["virtualbench"].call(ni_supply.dmm_volt_read, dmm)
+
+def close():
+    for lane in lanes.values():
+        lane.close()
+
+#Example: step the Chroma and the VirtualBench supply together, then read every instrument back at once.
+#Each result row is (v, c, Chroma V/I/P, 34401A reading, VirtualBench DMM reading).
+async def sweep(points, ps, dmm, chx=ni_supply.channel):
+    results = []
+    for v, c in points:
+        await asyncio.gather(set_and_settle(v, c), set_DC_out(ps, chx, v, c))
+        supply, meter, dmm_reading = await asyncio.gather(fetch_supply_out(), fetch_out(), dmm_volt_read(dmm))
+        results.append((v, c, supply, meter, dmm_reading))
+    return results
+
+def main():
+    virtualbench = ni_supply.VB_setup()
+    try:
+        ps = virtualbench.acquire_power_supply()
+        dmm = virtualbench.acquire_digital_multimeter()
+        chroma.ON_power()
+        try:
+            for row in asyncio.run(sweep([(1.0, 0.5), (2.0, 0.5), (5.0, 0.5)], ps, dmm)):
+                print(row)
+        finally:
+            chroma.OFF_power()                              #Never leave the output on, even if the sweep failed
+        ps.release()
+    finally:
+        virtualbench.release()
+        close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Shared SCPI session layer for the bench instrument drivers.
+
+@author: tcabildo
+"""
+
+#Every GPIB/USBTMC round trip costs milliseconds, so the session packs several commands into one
+#semicolon-compound SCPI message and reads all of the answers back in a single transaction.
+
+import pyvisa as visa
+
+rm = None
+
+#Function to get the resource manager shared by all sessions
+def resource_manager():
+    global rm
+    if rm is None:
+        rm = visa.ResourceManager()
+    return rm
+
+#Function to join commands into one compound message. Every command after the first gets a leading
+#colon so it is parsed from the root of the command tree, not relative to the previous header.
+def compound(commands):
+    message = commands[0]
+    for command in commands[1:]:
+        command = command.lstrip(":")
+        message += ";" + (command if command.startswith("*") else ":" + command)
+    return message
+
+class scpi_session():
+    """
+    One instrument on the bus. The connection is opened on first use, so a driver module can be
+    imported (and its functions reused) without the instrument being present.
+
+    Attributes:
+        resource_name - VISA resource string, e.g. 'GPIB0::21::INSTR'
+        timeout - I/O timeout for this instrument in milliseconds
+
+    Methods:
+        write - send one or more commands as a single message
+        query - send one or more queries as a single message, return the raw response
+        query_fields - same, split into one string per response field
+        query_values - same, converted to floats
+        wait_opc - block until the instrument reports all pending operations complete
+        close - close the connection
+    """
+    def __init__(self, resource_name, timeout=2000):
+        self.resource_name = resource_name
+        self._timeout = timeout
+        self._resource = None
+
+    @property
+    def resource(self):
+        if self._resource is None:
+            self._resource = resource_manager().open_resource(self.resource_name)
+            self._resource.timeout = self._timeout
+        return self._resource
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, ms):
+        self._timeout = ms
+        if self._resource is not None:
+            self._resource.timeout = ms
+
+    def write(self, *commands):
+        self.resource.write(compound(commands))
+
+    def query(self, *queries):
+        return self.resource.query(compound(queries)).strip()
+
+    def query_fields(self, *queries):
+        #Instruments separate the answers to a compound query with ';', and values within one answer
+        #with ','
+        response = self.query(*queries)
+        return [field.strip() for answer in response.split(";") for field in answer.split(",")]
+
+    def query_values(self, *queries):
+        return [float(field) for field in self.query_fields(*queries)]
+
+    def wait_opc(self, timeout=None):
+        #*OPC? only answers once every pending operation has finished, so this returns as soon as the
+        #instrument is done. The bus timeout is stretched to cover slow operations.
+        if timeout is None:
+            return self.query('*OPC?')
+        saved = self.timeout
+        self.timeout = timeout
+        try:
+            return self.query('*OPC?')
+        finally:
+            self.timeout = saved
+
+    def close(self):
+        if self._resource is not None:
+            self._resource.close()
+            self._resource = None
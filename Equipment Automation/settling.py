@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Condition-driven settling for the bench instrument drivers, instead of fixed time.sleep() delays.
+
+@author: tcabildo
+"""
+
+import time
+import warnings
+from collections import deque
+
+#Function to poll until condition() is true. Returns the time waited; raises TimeoutError if the
+#condition is still false after timeout seconds.
+def wait_until(condition, timeout=10.0, interval=0.01):
+    start = time.perf_counter()
+    while not condition():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("Condition not met after %.1f s" % timeout)
+        time.sleep(interval)
+    return time.perf_counter() - start
+
+#Function to read until the last count readings, taken interval seconds apart, agree with each other
+#(max - min <= tolerance). Returns the last reading. Waits only as long as the output actually takes to
+#settle; raises TimeoutError, with the readings that did not settle, after timeout seconds.
+#The readings cover (count - 1) * interval seconds, so interval must be positive and the window longer
+#than the output takes to start responding; a ramp slower than tolerance over that window still passes.
+#A target (the known setpoint) is only used to reject the old level, read before the output has started
+#to move: readings must also be within half the step (target - first reading) of the target, or within
+#accuracy of it, the instrument's readback accuracy. A readback offset smaller than that does not stop
+#the output counting as settled. If the readings are stable but never get there (e.g. the output is in
+#current limit), a warning is issued at timeout and the stable reading is returned.
+def wait_stable(read, tolerance, count=5, timeout=10.0, interval=0.05, target=None, accuracy=0.0):
+    if interval <= 0:
+        raise ValueError("wait_stable needs a polling interval > 0")
+    readings = deque(maxlen=count)
+    first = None
+    stable = False
+    start = time.perf_counter()
+    while True:
+        reading = read()
+        if first is None:
+            first = reading
+        readings.append(reading)
+        if len(readings) == count:
+            stable = max(readings) - min(readings) <= tolerance
+            if stable and target is None:
+                return reading
+            if stable and all(abs(r - target) <= max(abs(first - target) / 2, accuracy) for r in readings):
+                return reading
+        if time.perf_counter() - start > timeout:
+            if stable:
+                warnings.warn("Output settled at %g, not at the %g setpoint (current limit?)" % (reading, target))
+                return reading
+            raise TimeoutError("Not stable within %g after %.1f s: %s" % (tolerance, timeout, list(readings)))
+        time.sleep(interval)
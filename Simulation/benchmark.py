@@ -0,0 +1,133 @@
+"""Hardware-free throughput benchmark for the generation, push, capture and analysis paths.
+
+Runs the real code from ADC_Crash_Course and the CN0577 demo against the simulated backends in
+sim_instruments, and prints one line per stage. Usage:
+
+    python benchmark.py           # default link models, real-time capture and playout
+    python benchmark.py --fast    # zero latency, no real-time waits: host-side cost only
+"""
+
+import os
+import sys
+import time
+
+import numpy as np # Import NumPy library
+
+import sim_instruments
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("ADC_Crash_Course", "CN0577 Wavelet Demo", "Equipment Automation"):
+    sys.path.insert(0, os.path.join(root, folder))
+
+
+def bench(name, fn, items, unit, repeat=3):
+    """Best of repeat runs of fn(); fn processes items units per call."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    rate = items / best
+    print("%-34s %12.1f %-14s (%.3f s)" % (name, rate, unit, best))
+    return rate
+
+
+def check_closed_loop(ctx, my_adc, trials=5):
+    """Correctness check for closed_loop.compare() on the ideal simulated loopback: the captured wavelet
+    must come back with unity gain, at the shift the simulated ADC was started from. The simulated
+    ADC takes the M2K sample at or before each sampling instant, so the shift may read one sample early."""
+    from wavelet_gen import random_ricker, diff_synth, sr
+    from closed_loop import compare, period_samples, resize_rx
+
+    aout = ctx.getAnalogOut()
+    aout.setSampleRate(0, sr)
+    aout.setSampleRate(1, sr)
+    aout.setCyclic(True)
+    buffer_size = my_adc.rx_buffer_size
+    rng = np.random.default_rng(0)
+    try:
+        for _ in range(trials):
+            wav = random_ricker()
+            w1, w2 = diff_synth(wav)
+            aout.push([w1, w2])
+            period = period_samples(len(w1))
+            shift = int(rng.integers(period))
+            resize_rx(my_adc, period)
+            my_adc._sample = shift
+            r = compare(wav, my_adc.rx())
+            k = int(round(r["delay"] * my_adc.sampling_frequency))
+            if abs(r["gain"] - 1.0) > 1e-3 or (shift - k) % period > 1:
+                raise AssertionError("closed loop: gain %.5f and shift %d, expected 1 and %d" % (r["gain"], k, shift))
+    finally:
+        resize_rx(my_adc, buffer_size)
+    print("%-34s %12s gain and shift recovered in %d trials" % ("closed_loop.compare", "ok", trials))
+
+
+def main(fast=False):
+    if fast:
+        sim_instruments.realtime = False
+        for model in sim_instruments.models.values():
+            model.latency = 0.0
+            model.throughput = None
+    sim_instruments.install()
+
+    # Imported only after install(), so they pick up the simulated backends
+    from signal_gen import sine_sig_gen
+    from adc_analysis import analyze
+    import wavelet_gen
+    import cn0577_wavelet_demo as demo
+    from fft_cwt import fft_cwt
+    from closed_loop import closed_loop
+
+    results = {}
+
+    # Generation
+    gen = sine_sig_gen()
+    gen.t_noise = 7.6e-6
+    records = gen.generate_batch(1000)
+    results["sine_batch"] = bench("sine_sig_gen.generate_batch", lambda: gen.generate_batch(1000), 1000, "records/s")
+    results["wavelet"] = bench("random_ricker + diff_synth",
+                               lambda: [wavelet_gen.diff_synth(wavelet_gen.random_ricker()) for _ in range(20)],
+                               20, "wavelets/s")
+
+    # Analysis
+    results["analyze"] = bench("adc_analysis.analyze", lambda: analyze(records, window="rect"), 1000, "records/s")
+    capture = np.random.default_rng(0).normal(size=demo.n_samples)
+    results["cwt"] = bench("fft_cwt, 32 scales", lambda: fft_cwt(capture, np.arange(1, 33) * 8.0),
+                           demo.n_samples / 1e6, "MS/s", repeat=1)
+
+    # Push
+    ctx = wavelet_gen.wav_init()
+    long_wave = np.zeros(4 * wavelet_gen.max_buffer_size)
+    stats = {}
+    def push():
+        stats.update(wavelet_gen.stream_out(ctx, (long_wave, long_wave)))
+    results["push"] = bench("wavelet_gen.stream_out", push, len(long_wave) / 1e6, "MS/s", repeat=1)
+    print("%-34s %12d underruns" % ("", stats["underruns"]))
+
+    # Capture
+    my_adc = demo.setup_adc("ip:sim")
+    stats = demo.capture_burst(my_adc, 1.0)
+    results["capture"] = stats["msps"]
+    print("%-34s %12.1f %-14s (%d dropped)" % ("ring_capture", stats["msps"], "MS/s", stats["dropped"]))
+
+    # End to end
+    check_closed_loop(ctx, my_adc)
+    results["closed_loop"] = bench("closed_loop", lambda: closed_loop(ctx, my_adc, 10), 10 * 60, "wavelets/min",
+                                   repeat=1)
+
+    # Instrument bus
+    import Chroma_6200 as chroma
+    chroma.set_out(12.0, 2.5)
+    chroma.ON_power()
+    def readback():
+        for _ in range(10):
+            chroma.fetch_supply_out()
+    results["scpi_readback"] = bench("Chroma_6200.fetch_supply_out", readback, 10, "readbacks/s")
+
+    wavelet_gen.wav_close(ctx)
+    return results
+
+
+if __name__ == '__main__':
+    main(fast="--fast" in sys.argv)
@@ -0,0 +1,372 @@
+"""Simulated instrument backends, so the data paths in this repo can be profiled and regression-tested
+without hardware.
+
+install() puts stand-ins for libm2k, adi (ltc2387), pyvisa and pyvirtualbench into sys.modules. After
+that the scripts import and run unchanged. Every simulated transaction costs time according to a
+link_model (fixed latency plus a throughput term), so benchmarks see realistic relative costs. The
+simulated LTC2387 captures whatever the simulated M2K is playing (P - N), so closed-loop tests
+produce meaningful data.
+"""
+
+import sys
+import time
+import types
+import threading
+
+import numpy as np # Import NumPy library
+
+
+class link_model():
+    """
+    Attributes:
+        latency - fixed cost per transaction, seconds
+        throughput - items (samples, bytes) per second, or None for no size-dependent cost
+    """
+    def __init__(self, latency=0.0, throughput=None):
+        self.latency = latency
+        self.throughput = throughput
+
+    def cost(self, items=0):
+        t = self.latency
+        if self.throughput:
+            t += items / self.throughput
+        return t
+
+    def wait(self, items=0):
+        t = self.cost(items)
+        if t > 0:
+            time.sleep(t)
+
+
+models = {
+    "m2k_push": link_model(1e-3, 150e6),        # USB 2.0 bulk transfer of 16-bit samples
+    "adc_rx": link_model(0.5e-3),               # IIO buffer refill overhead, on top of real-time acquisition
+    "scpi": link_model(2e-3),                   # One GPIB/USBTMC round trip
+    "virtualbench": link_model(5e-3),           # One VirtualBench driver call
+}
+"""Default link models. Change them in place, or pass replacements to install()."""
+
+realtime = True
+"""When True, captures and non-cyclic playout take as long as they would on the wire (samples / rate).
+Set False to measure pure host-side cost."""
+
+
+# ----------------------------------------------------------------------------------------------------
+# ADALM2000 (libm2k)
+
+loopback = {"buffer": None, "rate": None, "lock": threading.Lock()}
+"""Last differential waveform pushed to the simulated M2K, read by the simulated LTC2387."""
+
+
+class sim_analog_out():
+    def __init__(self):
+        self.rates = [75000000, 75000000]
+        self.enabled = [False, False]
+        self.cyclic = True
+        self.pushed = 0
+
+    def setSampleRate(self, chn, rate):
+        models["m2k_push"].wait()
+        self.rates[chn] = rate
+
+    def enableChannel(self, chn, enable):
+        models["m2k_push"].wait()
+        self.enabled[chn] = enable
+
+    def setCyclic(self, cyclic):
+        self.cyclic = cyclic
+
+    def push(self, buffer):
+        n = len(buffer[0])
+        models["m2k_push"].wait(n * len(buffer))
+        if not self.cyclic and realtime:
+            time.sleep(n / self.rates[0])
+        with loopback["lock"]:
+            loopback["buffer"] = np.asarray(buffer[0], dtype=np.float64) - np.asarray(buffer[1], dtype=np.float64)
+            loopback["rate"] = self.rates[0]
+        self.pushed += n
+
+    def stop(self):
+        pass
+
+
+class sim_m2k():
+    def __init__(self, uri=None):
+        self.uri = uri
+        self.aout = sim_analog_out()
+
+    def calibrateADC(self):
+        return True
+
+    def calibrateDAC(self):
+        return True
+
+    def getAnalogOut(self):
+        return self.aout
+
+
+def m2kOpen(uri=None):
+    return sim_m2k(uri)
+
+
+def contextClose(ctx):
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------
+# LTC2387 (pyadi-iio)
+
+class ltc2387():
+    """Simulated LTC2387-18. rx() returns int32 codes of the loopback waveform plus thermal noise."""
+    vref = 4.096
+    noise_rms = 50e-6
+
+    def __init__(self, uri=None):
+        self.uri = uri
+        self.rx_buffer_size = 1024
+        self.sampling_frequency = 10000000
+        self._sample = 0
+        self._rng = np.random.default_rng(0)
+
+    def rx(self):
+        n = self.rx_buffer_size
+        models["adc_rx"].wait()
+        if realtime:
+            time.sleep(n / self.sampling_frequency)
+
+        with loopback["lock"]:
+            stim, rate = loopback["buffer"], loopback["rate"]
+        volts = self._rng.normal(0.0, self.noise_rms, n)
+        if stim is not None:
+            # Nearest M2K sample at each ADC sampling instant, continuing from the previous buffer
+            idx = (np.arange(self._sample, self._sample + n) * (rate / self.sampling_frequency)).astype(np.int64)
+            volts += stim[idx % len(stim)]
+        self._sample += n
+
+        codes = np.rint(volts * (2**17 / self.vref))
+        np.clip(codes, -2**17, 2**17 - 1, out=codes)
+        return codes.astype(np.int32)
+
+    def rx_destroy_buffer(self):
+        pass
+
+
+# ----------------------------------------------------------------------------------------------------
+# SCPI instruments (pyvisa)
+
+class sim_scpi_resource():
+    """Generic SCPI supply/DMM. Remembers setpoints and answers queries from them; handles
+    semicolon-compound messages, one response field per query."""
+    def __init__(self, name):
+        self.resource_name = name
+        self.timeout = 2000
+        self.state = {"VOLT": 0.0, "CURR": 0.0, "OUTP": 0, "SAMP": 1, "TRIG": 1}
+        self._rng = np.random.default_rng(1)
+        self._pending = ""
+        self.program = {}               # Sequence number -> [voltage, current, dwell]
+        self._seq = 1
+        self._run_start = None
+
+    def _program(self, header, arg):
+        """Chroma 62000P-style program (list) mode: PROG:SEQ:VOLT/CURR/TIME per sequence, PROG:RUN."""
+        if header.endswith("?"):
+            return "1" if self._run_start is not None and self._run_time() is not None else "0"
+        if "SEQ" in header and "SEL" in header:
+            self._seq = int(arg)
+        elif "SEQ" in header:
+            step = self.program.setdefault(self._seq, [0.0, 0.0, 0.0])
+            for i, key in enumerate(("VOLT", "CURR", "TIME")):
+                if key in header:
+                    step[i] = float(arg)
+        elif "CLE" in header:
+            self.program.clear()
+        elif "RUN" in header:
+            self._run_start = time.perf_counter() if arg.upper() in ("ON", "1") else None
+        return None
+
+    def _run_time(self):
+        """Setpoint of the program step active now, or None once the program has finished."""
+        t = time.perf_counter() - self._run_start
+        for seq in sorted(self.program):
+            v, c, dwell = self.program[seq]
+            if t < dwell:
+                return v, c
+            t -= dwell
+        return None
+
+    def _execute(self, command):
+        command = command.strip().lstrip(":")
+        header, _, arg = command.partition(" ")
+        header = header.upper()
+        if header.startswith("PROG"):
+            return self._program(header, arg)
+        if self._run_start is not None:
+            active = self._run_time()
+            if active is not None:
+                self.state["VOLT"], self.state["CURR"] = active
+        if header.endswith("?"):
+            return self._answer(header)
+        if "OUTP" in header:
+            self.state["OUTP"] = 1 if arg.upper() in ("ON", "1") else 0
+        elif header.startswith("SAMP") and arg:
+            self.state["SAMP"] = int(arg)
+        elif header.startswith("TRIG") and "COUN" in header and arg:
+            self.state["TRIG"] = int(arg)
+        elif header.startswith("CONF") or header.startswith("SENS") or "NPLC" in header:
+            pass
+        elif "VOLT" in header and arg:
+            self.state["VOLT"] = float(arg)
+        elif "CURR" in header and "LIM" not in header and arg:
+            self.state["CURR"] = float(arg)
+        elif header.startswith("ABOR"):
+            self.state["OUTP"] = 0
+        return None
+
+    def _answer(self, header):
+        if header == "*IDN?":
+            return "SIM,SCPI,0,1.0"
+        if header == "*OPC?":
+            return "1"
+        if header in ("READ?", "FETC?", "FETCH?"):
+            n = self.state["SAMP"] * self.state["TRIG"]
+            models["scpi"].wait(16 * n)
+            values = self.state["VOLT"] * self.state["OUTP"] + self._rng.normal(0.0, 1e-5, n)
+            return ",".join("%+.8E" % v for v in values)
+        volts = self.state["VOLT"] * self.state["OUTP"]
+        amps = self.state["CURR"] * self.state["OUTP"] * 0.1
+        if "POW" in header:
+            value = volts * amps
+        elif "CURR" in header:
+            value = amps
+        elif "VOLT" in header or header.startswith("READ") or header.startswith("FETC"):
+            value = volts
+        else:
+            return "0"
+        return "%+.8E" % (value + self._rng.normal(0.0, 1e-5))
+
+    def write(self, message):
+        models["scpi"].wait(len(message))
+        answers = [self._execute(c) for c in message.split(";")]
+        self._pending = ";".join(a for a in answers if a is not None)
+        return len(message)
+
+    def read(self):
+        text, self._pending = self._pending, ""
+        return text + "\n"
+
+    def query(self, message):
+        models["scpi"].wait(len(message))
+        answers = [self._execute(c) for c in message.split(";")]
+        return ";".join(a for a in answers if a is not None) + "\n"
+
+    def close(self):
+        pass
+
+
+class ResourceManager():
+    def __init__(self, *args):
+        self.resources = {}
+
+    def list_resources(self):
+        return tuple(self.resources)
+
+    def open_resource(self, name, **kwargs):
+        resource = sim_scpi_resource(name)
+        for key, value in kwargs.items():
+            setattr(resource, key, value)
+        self.resources[name] = resource
+        return resource
+
+
+# ----------------------------------------------------------------------------------------------------
+# VirtualBench (pyvirtualbench)
+
+class PyVirtualBenchException(Exception):
+    def __init__(self, status=0, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+class DmmFunction():
+    DC_VOLTS = 0
+    AC_VOLTS = 1
+    DC_CURRENT = 2
+    AC_CURRENT = 3
+    RESISTANCE = 4
+
+
+class sim_vb_supply():
+    def __init__(self, bench):
+        self.bench = bench
+        self.outputs = {}
+        self.enabled = False
+
+    def configure_voltage_output(self, channel, voltage, current_limit):
+        models["virtualbench"].wait()
+        self.outputs[channel] = (voltage, current_limit)
+        self.bench.supply_voltage = voltage
+
+    def enable_all_outputs(self, enable):
+        models["virtualbench"].wait()
+        self.enabled = enable
+
+    def read_output(self, channel):
+        models["virtualbench"].wait()
+        voltage, limit = self.outputs.get(channel, (0.0, 0.0))
+        if not self.enabled:
+            voltage = 0.0
+        return voltage, 0.1 * limit, "voltage controlled"
+
+    def release(self):
+        pass
+
+
+class sim_vb_dmm():
+    def __init__(self, bench):
+        self.bench = bench
+        self._rng = np.random.default_rng(2)
+
+    def configure_measurement(self, function, auto_range=True, manual_range=1.0):
+        models["virtualbench"].wait()
+
+    def read(self):
+        models["virtualbench"].wait()
+        return self.bench.supply_voltage + self._rng.normal(0.0, 1e-5)
+
+    def release(self):
+        pass
+
+
+class PyVirtualBench():
+    def __init__(self, device_name=""):
+        self.device_name = device_name
+        self.supply_voltage = 0.0
+
+    def acquire_power_supply(self):
+        return sim_vb_supply(self)
+
+    def acquire_digital_multimeter(self):
+        return sim_vb_dmm(self)
+
+    def release(self):
+        pass
+
+
+# ----------------------------------------------------------------------------------------------------
+
+def install(**link_models):
+    """Register the simulated backends as libm2k, adi, pyvisa and pyvirtualbench. Keyword arguments
+    replace entries of models, e.g. install(scpi=link_model(8e-3))."""
+    models.update(link_models)
+    this = sys.modules[__name__]
+    exports = {
+        "libm2k": ["m2kOpen", "contextClose"],
+        "adi": ["ltc2387"],
+        "pyvisa": ["ResourceManager"],
+        "pyvirtualbench": ["PyVirtualBench", "PyVirtualBenchException", "DmmFunction"],
+    }
+    for name, attrs in exports.items():
+        module = types.ModuleType(name, "Simulated %s (sim_instruments)" % name)
+        for attr in attrs:
+            setattr(module, attr, getattr(this, attr))
+        sys.modules[name] = module